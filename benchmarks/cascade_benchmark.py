@@ -0,0 +1,81 @@
+#Speed and recall of the detector cascade against the large model alone.
+#Run from the repo root:  python -m benchmarks.cascade_benchmark --images asserts/images
+import argparse
+import time
+from pathlib import Path
+
+from src.backend.file_manager import FileManager
+from src.backend.image_processing_yolo import ImageProcess
+from src.backend.cascade_detector import CascadeDetector
+from src.backend import box_operations as box_ops
+
+
+IMAGE_EXTENSIONS = ['.png', '.jpg', '.jpeg', '.bmp', '.webp', '.tiff', '.gif']
+
+
+def timed_detection(detector, image_paths, repeats):
+    #first pass warms caches/allocators, the best of the rest is reported
+    detector.object_detection(image_paths)
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        results = detector.object_detection(image_paths)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return results, best
+
+
+def recall(reference, candidate, iou_threshold):
+    #share of reference boxes matched by a candidate box of the same class
+    matched = total = 0
+    for image_name, ref in reference.items():
+        total += len(ref)
+        cand = candidate.get(image_name)
+        if cand is None or len(ref) == 0 or len(cand) == 0:
+            continue
+        iou = box_ops.box_iou(ref.xyxy, cand.xyxy)
+        iou[ref.cls[:, None] != cand.cls[None, :]] = 0
+        matched += int((iou.max(axis=1) >= iou_threshold).sum())
+    return matched / total if total else 1.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark cascaded detection against the large detector")
+    parser.add_argument("--images", default="asserts/images")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--iou", type=float, default=0.5)
+    parser.add_argument("--threshold", type=float, default=None, help="escalation confidence, defaults to cascade_threshold")
+    args = parser.parse_args()
+
+    file_manager = FileManager()
+    if not file_manager.has_model('detector_small'):
+        raise SystemExit("models_config.json has no 'detector_small' entry (or its file is missing)")
+
+    image_paths = [str(p) for p in sorted(Path(args.images).iterdir()) if p.suffix.lower() in IMAGE_EXTENSIONS]
+    if not image_paths:
+        raise SystemExit(f"No images found in {args.images}")
+
+    settings = file_manager.get_model_settings('detector')
+    threshold = args.threshold if args.threshold is not None else settings.get('cascade_threshold', 0.8)
+
+    large = ImageProcess._build_detector(file_manager, 'detector')
+    small = ImageProcess._build_detector(file_manager, 'detector_small')
+    cascade = CascadeDetector(small, large, escalate_below=threshold)
+
+    large_results, large_time = timed_detection(large, image_paths, args.repeats)
+    cascade.escalated = cascade.total = 0
+    cascade_results, cascade_time = timed_detection(cascade, image_paths, args.repeats)
+
+    print()
+    print(f"images             : {len(image_paths)}")
+    print(f"large model        : {large_time:.3f}s ({large_time / len(image_paths) * 1000:.1f} ms/img)")
+    print(f"cascade            : {cascade_time:.3f}s ({cascade_time / len(image_paths) * 1000:.1f} ms/img)")
+    print(f"speedup            : {large_time / max(cascade_time, 1e-9):.2f}x")
+    print(f"escalated          : {cascade.escalated}/{cascade.total} images (threshold {threshold})")
+    print(f"recall vs large    : {recall(large_results, cascade_results, args.iou):.3f} (IoU >= {args.iou})")
+
+    cascade.close()
+
+
+if __name__ == "__main__":
+    main()
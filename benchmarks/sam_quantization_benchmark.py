@@ -0,0 +1,102 @@
+#Speed and mask agreement of the reduced precision SAM modes against fp32.
+#Run from the repo root:  python -m benchmarks.sam_quantization_benchmark --images asserts/images
+import argparse
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from src.backend.file_manager import FileManager
+from src.backend.image_processing_yolo import ImageProcess
+from src.backend.sam_detector import SamExtractor
+
+
+IMAGE_EXTENSIONS = ['.png', '.jpg', '.jpeg', '.bmp', '.webp', '.tiff', '.gif']
+
+
+def benchmark_boxes(file_manager, image_paths):
+    #detector boxes per image, the centre half of the frame when nothing is found
+    detector = ImageProcess._build_detector(file_manager, 'detector')
+    detections = detector.object_detection(image_paths)
+    detector.close()
+
+    boxes = {}
+    for image_path in image_paths:
+        result = detections.get(Path(image_path).stem)
+        found = result.boxes() if result is not None else []
+        if not found:
+            height, width = cv2.imread(image_path).shape[:2]
+            found = [(width // 4, height // 4, width * 3 // 4, height * 3 // 4)]
+        boxes[image_path] = np.array(found, dtype=np.float32)
+    return boxes
+
+
+def run_precision(file_manager, precision, images, boxes, repeats):
+    model_path, model_config_path = file_manager.get_model_path('segmentor')
+    sam = SamExtractor(sam_path=model_path, sam_model_config=model_config_path, precision=precision)
+    sam.load_device()
+
+    #first pass warms allocators and kernels, the best of the rest is reported
+    best = None
+    for run in range(repeats + 1):
+        sam.reset_timings()
+        masks = {}
+        start = time.perf_counter()
+        for image_path, image in images.items():
+            sam.embedded_image = None
+            sam.encode_image(image, image_path)
+            masks[image_path] = sam.decode_masks(boxes[image_path], None, [])
+        elapsed = time.perf_counter() - start
+        if run > 0 and (best is None or elapsed < best[0]):
+            best = (elapsed, dict(sam.timings), masks)
+
+    used = sam.precision
+    sam.close()
+    return used, best
+
+
+def mask_iou(reference, candidate, box):
+    x1, y1, x2, y2 = box.astype(int)
+    ref, cand = reference[y1:y2, x1:x2] > 0, candidate[y1:y2, x1:x2] > 0
+    union = np.logical_or(ref, cand).sum()
+    return np.logical_and(ref, cand).sum() / union if union else 1.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark quantized SAM modes against fp32")
+    parser.add_argument("--images", default="asserts/images")
+    parser.add_argument("--repeats", type=int, default=2)
+    parser.add_argument("--modes", nargs="+", default=["int8", "bf16"])
+    args = parser.parse_args()
+
+    file_manager = FileManager()
+    image_paths = [str(p) for p in sorted(Path(args.images).iterdir()) if p.suffix.lower() in IMAGE_EXTENSIONS]
+    if not image_paths:
+        raise SystemExit(f"No images found in {args.images}")
+
+    images = {path: cv2.imread(path) for path in image_paths}
+    boxes = benchmark_boxes(file_manager, image_paths)
+    box_count = sum(len(b) for b in boxes.values())
+
+    _, (base_time, base_timings, base_masks) = run_precision(file_manager, 'fp32', images, boxes, args.repeats)
+
+    print()
+    print(f"images / boxes     : {len(image_paths)} / {box_count}")
+    print(f"fp32               : {base_time:.3f}s (encoder {base_timings['encoder_time']:.3f}s, decoder {base_timings['decoder_time']:.3f}s)")
+
+    for mode in args.modes:
+        used, (elapsed, timings, masks) = run_precision(file_manager, mode, images, boxes, args.repeats)
+        if used != mode:
+            print(f"{mode:<19}: not available here, skipped")
+            continue
+
+        ious = [mask_iou(base_masks[path][i], masks[path][i], box)
+                for path in image_paths for i, box in enumerate(boxes[path])]
+        print(f"{mode:<19}: {elapsed:.3f}s (encoder {timings['encoder_time']:.3f}s, decoder {timings['decoder_time']:.3f}s), "
+              f"speedup {base_time / max(elapsed, 1e-9):.2f}x, "
+              f"mask IoU vs fp32 mean {np.mean(ious):.3f} / min {np.min(ious):.3f}")
+
+
+if __name__ == "__main__":
+    main()
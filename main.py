@@ -4,10 +4,10 @@ from PyQt6.QtWidgets import (QApplication, QDialog, QVBoxLayout,QWidget,
 from PyQt6.QtGui import QIcon,QFont,QPixmap
 from PyQt6.QtCore import QTimer,Qt
 import shutil
+import multiprocessing
 
 from src.backend.file_manager import FileManager
 from src.backend_helpers.helper_thread import WorkerThreadDownload
-from src.frontend.main_window import MainWindow
 from src.backend_helpers.path_helper import resource_path
 
 
@@ -188,6 +188,10 @@ class DownloadDialog(QDialog):
 
 
 def main():
+    #imported here, not at module level: spawned detection workers re-import this file and should
+    #not pay for the viewers, torch and sam2
+    from src.frontend.main_window import MainWindow
+
     #Check models 
     file_manager = FileManager()
     models_ready = file_manager.check_if_required_models_exist()
@@ -202,6 +206,7 @@ def main():
         #launch main app
         window = MainWindow()
         window.show()
+        window.start_preloading()
         sys.exit(app.exec())
     else:
         #show download dialog
@@ -213,10 +218,13 @@ def main():
             #Download successful ,launch app
             window = MainWindow()
             window.show()
+            window.start_preloading()
             sys.exit(app.exec())
         else:
             sys.exit(0)
 
 
 if __name__ == "__main__":
+    #needed for the detection worker processes in the frozen exe
+    multiprocessing.freeze_support()
     main()
\ No newline at end of file
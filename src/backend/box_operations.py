@@ -0,0 +1,128 @@
+import numpy as np
+
+
+
+def box_area(boxes):
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    return np.clip(boxes[:, 2] - boxes[:, 0], 0, None) * np.clip(boxes[:, 3] - boxes[:, 1], 0, None)
+
+
+def box_intersection(boxes_a, boxes_b):
+    #pairwise intersection areas, (N,4) x (M,4) -> (N,M)
+    boxes_a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    boxes_b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+
+    top_left = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    bottom_right = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    wh = np.clip(bottom_right - top_left, 0, None)
+
+    return wh[..., 0] * wh[..., 1]
+
+
+def box_iou(boxes_a, boxes_b):
+    #pairwise IoU, (N,4) x (M,4) -> (N,M)
+    inter = box_intersection(boxes_a, boxes_b)
+    union = box_area(boxes_a)[:, None] + box_area(boxes_b)[None, :] - inter
+    return inter / np.maximum(union, 1e-9)
+
+
+def nms(boxes, scores, iou_threshold, classes=None):
+    #greedy NMS, every step suppresses all remaining boxes at once. Returns kept indices by descending score
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    scores = np.asarray(scores, dtype=np.float32).reshape(-1)
+    if len(boxes) == 0:
+        return np.empty(0, dtype=np.int64)
+
+    if classes is not None:
+        #shift every class to its own region so boxes of different classes never overlap
+        offsets = np.asarray(classes, dtype=np.float32).reshape(-1, 1) * (boxes.max() + 1)
+        boxes = boxes + offsets
+
+    areas = box_area(boxes)
+    order = scores.argsort()[::-1]
+    keep = []
+
+    while order.size:
+        best = order[0]
+        keep.append(best)
+        rest = order[1:]
+
+        top_left = np.maximum(boxes[best, :2], boxes[rest, :2])
+        bottom_right = np.minimum(boxes[best, 2:], boxes[rest, 2:])
+        wh = np.clip(bottom_right - top_left, 0, None)
+        inter = wh[:, 0] * wh[:, 1]
+        iou = inter / np.maximum(areas[best] + areas[rest] - inter, 1e-9)
+
+        order = rest[iou <= iou_threshold]
+
+    return np.array(keep, dtype=np.int64)
+
+
+def unletterbox_boxes(xyxy, orig_hw, ratio, pad):
+    #boxes from letterboxed input pixels back to original image pixels, clipped to the image
+    pad_x, pad_y = pad
+    xyxy = (np.asarray(xyxy, dtype=np.float32) - np.array([pad_x, pad_y, pad_x, pad_y], dtype=np.float32)) / ratio
+    h, w = orig_hw
+    xyxy[:, [0, 2]] = xyxy[:, [0, 2]].clip(0, w)
+    xyxy[:, [1, 3]] = xyxy[:, [1, 3]].clip(0, h)
+    return xyxy
+
+
+def tile_origins(length, tile_size, overlap):
+    #start offsets along one axis, last tile is pushed back so it ends on the image border
+    if length <= tile_size:
+        return [0]
+
+    step = max(1, int(tile_size * (1 - overlap)))
+    starts = list(range(0, length - tile_size, step))
+    starts.append(length - tile_size)
+    return starts
+
+
+def consolidate_boxes(boxes, scores, classes=None, iou_threshold=0.7, containment_threshold=0.95,
+                      class_aware=True, merge=False):
+    #Suppresses (or merges into a union box) boxes that overlap a higher scoring one by IoU,
+    #or that lie mostly inside it. Class -1 (manual boxes) matches every class for IoU overlap only,
+    #containment needs the exact same class so a manual box never swallows the detections inside it.
+    #Returns the kept boxes as int tuples, in input order
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    if len(boxes) == 0:
+        return []
+
+    scores = np.asarray(scores, dtype=np.float32).reshape(-1)
+    inter = box_intersection(boxes, boxes)
+    areas = box_area(boxes)
+    iou = inter / np.maximum(areas[:, None] + areas[None, :] - inter, 1e-9)
+    #contained[i, j]: share of box j that lies inside box i
+    contained = inter / np.maximum(areas[None, :], 1e-9)
+
+    overlapping = iou >= iou_threshold
+    containing = contained >= containment_threshold
+    if class_aware and classes is not None:
+        classes = np.asarray(classes).reshape(-1)
+        exact_class = classes[:, None] == classes[None, :]
+        wildcard = (classes[:, None] == -1) | (classes[None, :] == -1)
+        overlapping &= exact_class | wildcard
+        containing &= exact_class
+    overlaps = overlapping | containing
+
+    #stable order so equal scores keep their input order
+    order = np.argsort(-scores, kind='stable')
+    suppressed = np.zeros(len(boxes), dtype=bool)
+    kept = {}
+
+    for i in order:
+        if suppressed[i]:
+            continue
+        cluster = overlaps[i] & ~suppressed
+        cluster[i] = True
+        suppressed |= cluster
+
+        if merge:
+            members = boxes[cluster]
+            box = np.concatenate([members[:, :2].min(axis=0), members[:, 2:].max(axis=0)])
+        else:
+            box = boxes[i]
+        kept[i] = tuple(int(v) for v in box)
+
+    return [kept[i] for i in sorted(kept)]
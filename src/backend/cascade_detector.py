@@ -0,0 +1,69 @@
+from pathlib import Path
+
+
+
+class CascadeDetector():
+    #Small model on every image, large model only for images it is unsure about
+    def __init__(self,small_detector,large_detector,escalate_below=0.8):
+        #large_detector should be created lazy so its checkpoint is only loaded when an image needs it
+        self.small = small_detector
+        self.large = large_detector
+        self.escalate_below = escalate_below
+        self.escalated = 0
+        self.total = 0
+
+
+    @property
+    def names(self):
+        return self.small.names
+
+
+    @property
+    def load_stages(self):
+        return self.small.load_stages
+
+
+    def load_steps(self):
+        #the large model stays lazy, it is only needed for uncertain images
+        yield from self.small.load_steps()
+
+
+    def cache_signature(self):
+        return self.make_signature(self.escalate_below, self.small.cache_signature(), self.large.cache_signature())
+
+
+    @staticmethod
+    def make_signature(escalate_below,small_signature,large_signature):
+        return f"cascade<{escalate_below}>|{small_signature}|{large_signature}"
+
+
+    def needs_escalation(self,detections):
+        return len(detections) == 0 or detections.max_confidence() < self.escalate_below
+
+
+    def iter_object_detection(self,image_paths):
+        image_paths = list(image_paths)
+        escalate = []
+
+        for detections in self.small.iter_object_detection(image_paths):
+            if self.needs_escalation(detections):
+                escalate.append(detections.image_path)
+            else:
+                yield detections
+
+        self.total += len(image_paths)
+        self.escalated += len(escalate)
+        print(f" Cascade: {len(escalate)}/{len(image_paths)} images escalated to the large model")
+
+        if escalate:
+            yield from self.large.iter_object_detection(escalate)
+
+
+    def object_detection(self,image_paths):
+        return {Path(detections.image_path).stem: detections for detections in self.iter_object_detection(image_paths)}
+
+
+    def close(self):
+        self.small.close()
+        self.large.close()
+
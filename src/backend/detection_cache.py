@@ -0,0 +1,85 @@
+import sqlite3
+import json
+import threading
+import time
+import numpy as np
+
+from src.backend.detection_result import DetectionResult
+
+
+
+class DetectionCache():
+    #Detections stored on disk (SQLite) keyed by image content + model/threshold signature, LRU evicted
+    def __init__(self,db_path,max_entries=2000):
+        self.db_path = str(db_path)
+        self.max_entries = max(1, int(max_entries))
+        self._memory = {}
+        self._lock = threading.Lock()
+        #created on the ui thread but used from the yolo worker thread
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS detections (
+                                key TEXT PRIMARY KEY,
+                                xyxy BLOB NOT NULL,
+                                conf BLOB NOT NULL,
+                                cls BLOB NOT NULL,
+                                names TEXT,
+                                last_used REAL NOT NULL)""")
+        #caches written before the class names were stored get the column, their old rows count as misses
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(detections)")]
+        if 'names' not in columns:
+            self._conn.execute("ALTER TABLE detections ADD COLUMN names TEXT")
+        self._conn.commit()
+
+
+    def get(self,key,image_path):
+        #class names come from the row, so a fully cached image set never needs the model loaded
+        with self._lock:
+            row = self._memory.get(key)
+            if row is None:
+                row = self._conn.execute("SELECT xyxy, conf, cls, names FROM detections WHERE key = ?", (key,)).fetchone()
+                if row is None or row[3] is None:
+                    return None
+                self._remember(key, row)
+
+            self._conn.execute("UPDATE detections SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+
+        xyxy, conf, cls, names = row
+        return DetectionResult(image_path,
+                               np.frombuffer(xyxy, dtype=np.int32),
+                               np.frombuffer(conf, dtype=np.float32),
+                               np.frombuffer(cls, dtype=np.int32),
+                               {int(i): name for i, name in json.loads(names)})
+
+
+    def put(self,key,detections):
+        #names as [id, name] pairs, json object keys would turn the class ids into strings
+        names = detections.names.items() if isinstance(detections.names, dict) else enumerate(detections.names)
+        row = (detections.xyxy.tobytes(), detections.conf.tobytes(), detections.cls.tobytes(),
+               json.dumps([[int(i), name] for i, name in names]))
+        with self._lock:
+            self._remember(key, row)
+            self._conn.execute("INSERT OR REPLACE INTO detections (key, xyxy, conf, cls, names, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                               (key, *row, time.time()))
+            self._evict()
+            self._conn.commit()
+
+
+    def _remember(self,key,row):
+        #session copy of the rows, bounded the same way as the table
+        if len(self._memory) >= self.max_entries:
+            self._memory.clear()
+        self._memory[key] = row
+
+
+    def _evict(self):
+        #keep only the max_entries most recently used rows
+        self._conn.execute("""DELETE FROM detections WHERE key NOT IN
+                                (SELECT key FROM detections ORDER BY last_used DESC LIMIT ?)""", (self.max_entries,))
+
+
+    def close(self):
+        with self._lock:
+            self._memory.clear()
+            self._conn.close()
+
@@ -0,0 +1,110 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
+import os
+
+#spawned workers re-import the parent's main module before _init_worker runs. main.py keeps its heavy
+#imports inside main(), so torch/MKL/OpenMP are first loaded in _init_worker, after the thread limits
+#are set there. The parent's environment is never touched
+
+
+_worker_detector = None
+
+
+def _init_worker(threads):
+    global _worker_detector
+    #must happen before torch/onnxruntime create their thread pools
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads)
+
+    #pip opencv ignores OMP_NUM_THREADS and sizes its own pool to all cores, decode/letterbox in
+    #N workers would oversubscribe the machine
+    import cv2
+    cv2.setNumThreads(1)
+
+    import torch
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(1)
+
+    from src.backend.file_manager import FileManager
+    from src.backend.image_processing_yolo import ImageProcess
+
+    #the prefetch decode threads share the worker's core budget too
+    overrides = {'num_threads': threads, 'intra_op_threads': threads, 'inter_op_threads': 1,
+                 'prefetch_workers': max(1, min(threads, 2))}
+    _worker_detector = ImageProcess.build_detector(FileManager(), overrides=overrides)
+
+
+def _detect_shard(image_paths):
+    return list(_worker_detector.iter_object_detection(image_paths))
+
+
+def _worker_names():
+    return _worker_detector.names
+
+
+
+class ProcessPoolDetector():
+    #Shards images over worker processes, every worker loads the model once and keeps it
+    def __init__(self,workers,threads_per_worker=None,batch_size=8):
+        self.workers = max(1, int(workers))
+        cores = os.cpu_count() or 1
+        #split the cores so the workers' intra-op pools don't fight over them
+        self.threads_per_worker = int(threads_per_worker) if threads_per_worker else max(1, cores // self.workers)
+        self.batch_size = max(1, int(batch_size))
+        self.executor = None
+        self._names = None
+        self._signature = None
+
+
+    def _ensure_pool(self):
+        if self.executor is None:
+            print(f" Starting {self.workers} detection workers x {self.threads_per_worker} threads")
+            #spawn: no forked torch/cuda state and the same behaviour on windows
+            context = multiprocessing.get_context('spawn')
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context,
+                                                initializer=_init_worker, initargs=(self.threads_per_worker,))
+        return self.executor
+
+
+    @property
+    def names(self):
+        if self._names is None:
+            self._names = self._ensure_pool().submit(_worker_names).result()
+        return self._names
+
+
+    def cache_signature(self):
+        #the workers' detector signature from the settings, nothing is built in this process
+        if self._signature is None:
+            from src.backend.file_manager import FileManager
+            from src.backend.image_processing_yolo import ImageProcess
+
+            self._signature = ImageProcess.detector_signature(FileManager())
+        return self._signature
+
+
+    def _shards(self,image_paths):
+        #small shards keep every worker busy even when some images are slower
+        for start in range(0, len(image_paths), self.batch_size):
+            yield image_paths[start:start + self.batch_size]
+
+
+    def iter_object_detection(self,image_paths):
+        image_paths = list(image_paths)
+        executor = self._ensure_pool()
+        print(f" Processing {len(image_paths)} images on {self.workers} worker processes...")
+
+        futures = [executor.submit(_detect_shard, shard) for shard in self._shards(image_paths)]
+        for future in as_completed(futures):
+            yield from future.result()
+
+
+    def object_detection(self,image_paths):
+        return {detections.image_name: detections for detections in self.iter_object_detection(image_paths)}
+
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+
@@ -0,0 +1,67 @@
+from pathlib import Path
+import numpy as np
+
+
+
+class DetectionResult():
+    #Detections of one image stored column wise: xyxy (N,4) int32, conf (N,) float32, cls (N,) int32
+    __slots__ = ('image_path', 'xyxy', 'conf', 'cls', 'names')
+
+    def __init__(self,image_path,xyxy,conf,cls,names):
+        self.image_path = image_path
+        self.xyxy = np.ascontiguousarray(xyxy, dtype=np.int32).reshape(-1, 4)
+        self.conf = np.ascontiguousarray(conf, dtype=np.float32).reshape(-1)
+        self.cls = np.ascontiguousarray(cls, dtype=np.int32).reshape(-1)
+        self.names = names
+
+
+    @classmethod
+    def empty(cls,image_path,names):
+        return cls(image_path, np.empty((0, 4)), np.empty(0), np.empty(0), names)
+
+
+    @classmethod
+    def from_data(cls,image_path,data,names):
+        #data is a (N,6) array of x1,y1,x2,y2,conf,cls rows as produced by the detector backends
+        if len(data) == 0:
+            return cls.empty(image_path, names)
+        return cls(image_path, data[:, :4], data[:, 4], data[:, 5], names)
+
+
+    @property
+    def image_name(self):
+        return Path(self.image_path).stem
+
+
+    def __len__(self):
+        return len(self.conf)
+
+
+    def __getitem__(self, index):
+        #dict view of a single detection, same keys the old per-box dicts had
+        class_id = int(self.cls[index])
+        return {
+            'box': tuple(self.xyxy[index].tolist()),
+            'confidence': round(float(self.conf[index]), 3),
+            'class_id': class_id,
+            'class_name': self.names[class_id] if self.names else str(class_id)
+        }
+
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+
+    def boxes(self):
+        #plain (x1,y1,x2,y2) int tuples, what the drawing/confirm code works with
+        return [tuple(box) for box in self.xyxy.tolist()]
+
+
+    def max_confidence(self):
+        return float(self.conf.max()) if len(self) else 0.0
+
+
+    def __repr__(self):
+        return f"DetectionResult({self.image_name}, {len(self)} boxes)"
+
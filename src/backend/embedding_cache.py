@@ -0,0 +1,140 @@
+from collections import OrderedDict
+from pathlib import Path
+import numpy as np
+import threading
+import shutil
+import json
+import uuid
+import os
+
+from src.backend_helpers.hashing import text_hash
+
+
+
+class EmbeddingCache():
+    #SAM image embeddings on disk as .npy files, memory mapped on load. One folder per
+    #(image content, checkpoint, model config) key, least recently used folders go first.
+    #An optional in-memory tier (memory_mb) keeps the most recent embeddings off the disk path
+    def __init__(self,cache_dir,max_mb=2048,memory_mb=0):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.memory_max_bytes = int(memory_mb * 1024 * 1024)
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+        self.lock = threading.Lock()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+
+    @staticmethod
+    def make_key(image_hash,model_signature):
+        return text_hash(image_hash, model_signature)
+
+
+    def get(self,key):
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                return self.memory[key]
+
+        entry = self.cache_dir / key
+        meta_path = entry / "meta.json"
+        if not meta_path.exists():
+            return None
+
+        try:
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+
+            image_embed = np.load(entry / "image_embed.npy", mmap_mode='r')
+            high_res_feats = [np.load(entry / f"high_res_{i}.npy", mmap_mode='r') for i in range(meta['high_res_count'])]
+            #folder mtime is the LRU clock, the entry may have been evicted meanwhile
+            os.utime(entry)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Embedding cache entry unreadable, dropping it: {e}")
+            shutil.rmtree(entry, ignore_errors=True)
+            return None
+
+        return image_embed, high_res_feats, tuple(meta['orig_hw'])
+
+
+    def put(self,key,image_embed,high_res_feats,orig_hw):
+        self._remember(key,image_embed,high_res_feats,orig_hw)
+
+        entry = self.cache_dir / key
+        if entry.exists():
+            try:
+                os.utime(entry)
+                return
+            except OSError:
+                #evicted between the check and the touch, write it again
+                pass
+
+        #write into a temp folder and rename, so a half written entry is never picked up
+        tmp = self.cache_dir / f".tmp-{uuid.uuid4().hex}"
+        tmp.mkdir()
+        try:
+            np.save(tmp / "image_embed.npy", np.ascontiguousarray(image_embed))
+            for i, feat in enumerate(high_res_feats):
+                np.save(tmp / f"high_res_{i}.npy", np.ascontiguousarray(feat))
+            with open(tmp / "meta.json", 'w') as f:
+                json.dump({'orig_hw': list(orig_hw), 'high_res_count': len(high_res_feats)}, f)
+            os.replace(tmp, entry)
+        except OSError as e:
+            print(f"Could not store embedding: {e}")
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+
+        self._evict()
+
+
+    def _remember(self,key,image_embed,high_res_feats,orig_hw):
+        if self.memory_max_bytes <= 0:
+            return
+        value = (np.array(image_embed), [np.array(feat) for feat in high_res_feats], tuple(orig_hw))
+        size = value[0].nbytes + sum(feat.nbytes for feat in value[1])
+        if size > self.memory_max_bytes:
+            return
+
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                return
+            self.memory[key] = value
+            self.memory_bytes += size
+            while self.memory_bytes > self.memory_max_bytes:
+                _, (embed, feats, _) = self.memory.popitem(last=False)
+                self.memory_bytes -= embed.nbytes + sum(feat.nbytes for feat in feats)
+
+
+    def _evict(self):
+        entries = []
+        for entry in self.cache_dir.iterdir():
+            if entry.is_dir() and not entry.name.startswith(".tmp-"):
+                try:
+                    size = sum(f.stat().st_size for f in entry.iterdir())
+                    entries.append((entry.stat().st_mtime, size, entry))
+                except OSError:
+                    #removed by another instance while scanning
+                    continue
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+
+
+_shared_caches = {}
+_shared_lock = threading.Lock()
+
+
+def shared_embedding_cache(cache_dir,max_mb=2048,memory_mb=0):
+    #one cache per folder for the whole session, so embeddings precomputed in one window are
+    #still in memory when the next window segments
+    with _shared_lock:
+        key = str(Path(cache_dir).resolve())
+        if key not in _shared_caches:
+            _shared_caches[key] = EmbeddingCache(cache_dir,max_mb,memory_mb)
+        return _shared_caches[key]
@@ -5,6 +5,7 @@ import json
 import shutil
 import requests
 import zipfile
+import importlib.util
 
 
 class FileManager:
@@ -24,7 +25,7 @@ class FileManager:
         
 
 
-    def get_model_path(self, model_type):
+    def get_model_path(self, model_type, resolve_backend=False):
         # Load JSON config
         with open(self.config_path, 'r') as f:
             config = json.load(f)
@@ -38,7 +39,63 @@ class FileManager:
         if config['models'][model_type].get("config", None):
             model_config_path = self.base_dir / "models" / config['models'][model_type]['config_path']
 
+        if resolve_backend:
+            return str(model_path), str(model_config_path), self.resolve_backend(model_type)
+
         return str(model_path), str(model_config_path)
+
+
+    def resolve_backend(self, model_type):
+        #'torch', 'onnx' or 'auto' (onnx runtime when there is no cuda and onnxruntime is installed)
+        backend = self.get_model_settings(model_type).get('backend', 'auto')
+        if backend != 'auto':
+            return backend
+
+        try:
+            import torch
+            if torch.cuda.is_available():
+                return 'torch'
+        except Exception as e:
+            print(f"Gpu detection failed while resolving backend: {e}")
+
+        return 'onnx' if importlib.util.find_spec('onnxruntime') is not None else 'torch'
+
+
+    def has_model(self, model_type):
+        #Optional model entries (e.g. 'detector_small') only count when their file is present
+        with open(self.config_path, 'r') as f:
+            config = json.load(f)
+
+        entry = config['models'].get(model_type)
+        return bool(entry) and (self.models_dir / entry['path']).exists()
+
+
+    def segmentor_model_type(self, tier='final'):
+        #'preview' is the optional small SAM2 entry ('segmentor_preview') for interactive work,
+        #without it every tier runs on the main 'segmentor'
+        if tier == 'preview' and self.has_model('segmentor_preview'):
+            return 'segmentor_preview'
+        return 'segmentor'
+
+
+    def get_model_settings(self, model_type):
+        #Optional tuning values stored next to 'path' in the model entry (batch_size, imgsz, ...)
+        with open(self.config_path, 'r') as f:
+            config = json.load(f)
+
+        entry = config['models'].get(model_type, {})
+        return entry.get('settings', {})
+
+
+    def get_pool_settings(self):
+        #Optional top level "model_pool" block: budget_mb (loaded models kept resident) and idle_timeout (seconds)
+        try:
+            with open(self.config_path, 'r') as f:
+                config = json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+        return config.get('model_pool', {})
  
 
     def check_if_required_models_exist(self):
@@ -4,6 +4,7 @@ import numpy as np
 
 from src.backend.edit_options import EditOptions
 from src.frontend_helper import image_converters as img_conv
+from src.backend.packed_object import PackedObject
 
 class EditManager():
     def __init__(self):
@@ -20,6 +21,10 @@ class EditManager():
         if isinstance(image_path_or_image,str):
             self.original_image_dict.setdefault(image_name,image_path_or_image)
             org_image = cv2.imread(image_path_or_image, cv2.IMREAD_UNCHANGED)
+        elif isinstance(image_path_or_image,PackedObject):
+            #packed objects are kept packed, the dense image only lives long enough for the display copy
+            self.original_image_dict.setdefault(image_name,image_path_or_image)
+            org_image = image_path_or_image.to_bgra()
         else:
             self.original_image_dict.setdefault(image_name,image_path_or_image)
             org_image = image_path_or_image
@@ -187,20 +192,24 @@ class EditManager():
 
         final_point_dict = {}
         for image in self.command_stack['Undo']:
-            image_path = self.original_image_dict[image]
-            points = []
-            point_type = []
-            if self.command_stack['Undo'][image]:
-                for commands in self.command_stack['Undo'][image]:
-                    if commands[0] == 'Pixel' and commands[1] == 'get_points':
-                        point , type = commands[2]
-                        org_point = img_conv.resize_to_original_coordinates(point,disp_size,image_path)
-                        points.append(org_point)
-                        if type == 'Object':
-                            point_type.append(1)
-                        elif type == 'Background':
-                            point_type.append(0)
-
-            final_point_dict[image] = (points,point_type)
+            final_point_dict[image] = self.get_image_points(image,disp_size)
 
         return final_point_dict
+
+
+    def get_image_points(self,image_name,disp_size,org_image=None):
+        #points of one image in original coordinates, org_image saves re-reading the file when the caller has it
+        org_image = self.original_image_dict[image_name] if org_image is None else org_image
+        points = []
+        point_type = []
+        for commands in self.command_stack['Undo'].get(image_name,[]):
+            if commands[0] == 'Pixel' and commands[1] == 'get_points':
+                point , type = commands[2]
+                org_point = img_conv.resize_to_original_coordinates(point,disp_size,org_image)
+                points.append(org_point)
+                if type == 'Object':
+                    point_type.append(1)
+                elif type == 'Background':
+                    point_type.append(0)
+
+        return (points,point_type)
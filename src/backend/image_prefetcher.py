@@ -0,0 +1,118 @@
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import cv2
+
+
+
+def stride_ceil(size, stride=32):
+    #next multiple of the model stride, tensor inputs have to be divisible by it
+    return -(-int(size) // stride) * stride
+
+
+def letterbox_shape(hw, imgsz, stride=32):
+    #smallest stride aligned (h, w) holding the image scaled to fit imgsz, like ultralytics' LetterBox(auto=True):
+    #a 16:9 frame at 640 becomes 384x640 instead of a 640x640 square
+    h, w = hw
+    ratio = min(imgsz / h, imgsz / w)
+    return stride_ceil(round(h * ratio), stride), stride_ceil(round(w * ratio), stride)
+
+
+def letterbox_into(image, out, imgsz, pad_value=114):
+    #resize keeping aspect ratio to fit imgsz, centred into out (3,H,W) float32 RGB 0-1,
+    #returns (orig_hw, ratio, (pad_x, pad_y))
+    h, w = image.shape[:2]
+    out_h, out_w = out.shape[1:]
+    ratio = min(imgsz / h, imgsz / w)
+    new_w, new_h = int(round(w * ratio)), int(round(h * ratio))
+    left = int(round((out_w - new_w) / 2 - 0.1))
+    top = int(round((out_h - new_h) / 2 - 0.1))
+
+    resized = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+
+    out.fill(pad_value / 255.0)
+    #BGR HWC uint8 -> RGB CHW float written straight into the buffer, no temporaries
+    np.multiply(resized[:, :, 2::-1].transpose(2, 0, 1), 1 / 255.0,
+                out=out[:, top:top + new_h, left:left + new_w], casting='unsafe')
+
+    return (h, w), ratio, (left, top)
+
+
+def letterbox_batch(images, imgsz, stride=32, buffer=None, executor=None):
+    #one (N,3,H,W) array for the batch, H and W the smallest stride aligned size every frame fits in.
+    #buffer (any contiguous float32 array big enough) is reused instead of allocating
+    shapes = [letterbox_shape(image.shape[:2], imgsz, stride) for image in images]
+    height, width = max(h for h, _ in shapes), max(w for _, w in shapes)
+    size = len(images) * 3 * height * width
+    array = np.empty(size, dtype=np.float32) if buffer is None else buffer.reshape(-1)[:size]
+    array = array.reshape(len(images), 3, height, width)
+
+    mapper = map if executor is None else executor.map
+    metas = list(mapper(letterbox_into, images, array, [imgsz] * len(images)))
+    return array, metas
+
+
+def read_image(image_path):
+    image = cv2.imread(image_path)
+    if image is None:
+        raise FileNotFoundError(f"Could not read image at path: {image_path}")
+    return image
+
+
+
+class PrefetchedBatch():
+    __slots__ = ('paths', 'array', 'metas')
+
+    def __init__(self,paths,array,metas):
+        self.paths = paths
+        self.array = array
+        self.metas = metas
+
+
+
+class ImagePrefetcher():
+    #Decodes and letterboxes the next batch on a thread pool while the current one is inferred
+    def __init__(self,image_paths,imgsz,batch_size=8,workers=4,pin_memory=False,stride=32):
+        self.image_paths = list(image_paths)
+        self.stride = stride
+        self.imgsz = stride_ceil(imgsz, stride)
+        self.batch_size = max(1, int(batch_size))
+        self.workers = max(1, int(workers))
+        #two buffers: one being filled, one being consumed. Sized for square frames, a batch
+        #uses the front part of one for its own (smaller) shape
+        self.buffers = [self._allocate(pin_memory) for _ in range(2)]
+
+
+    def _allocate(self,pin_memory):
+        shape = (self.batch_size, 3, self.imgsz, self.imgsz)
+        if pin_memory:
+            #page locked host memory makes the copy to the gpu asynchronous
+            import torch
+            return torch.empty(shape, dtype=torch.float32, pin_memory=True).numpy()
+        return np.empty(shape, dtype=np.float32)
+
+
+    def _prepare(self,executor,paths,buffer):
+        #the batch shape depends on every frame of it, so all are decoded before any is letterboxed
+        images = list(executor.map(read_image, paths))
+        return letterbox_batch(images, self.imgsz, self.stride, buffer, executor)
+
+
+    def __iter__(self):
+        chunks = [self.image_paths[start:start + self.batch_size]
+                  for start in range(0, len(self.image_paths), self.batch_size)]
+        if not chunks:
+            return
+
+        #one thread runs the batch preparation, the decode/letterbox work inside it goes to the pool
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="prefetch") as executor, \
+             ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch-batch") as coordinator:
+            pending = coordinator.submit(self._prepare, executor, chunks[0], self.buffers[0])
+
+            for index, paths in enumerate(chunks):
+                array, metas = pending.result()
+
+                #the other buffer's batch was already consumed, start filling it with the next one
+                if index + 1 < len(chunks):
+                    pending = coordinator.submit(self._prepare, executor, chunks[index + 1], self.buffers[(index + 1) % 2])
+
+                yield PrefetchedBatch(paths, array, metas)
@@ -1,48 +1,206 @@
-
 import cv2
 from pathlib import Path
 
 from src.backend.yolo_detector import YoloDetector
+from src.backend.cascade_detector import CascadeDetector
+from src.backend.detection_pool import ProcessPoolDetector
+from src.backend.detection_cache import DetectionCache
 from src.backend.file_manager import FileManager
+from src.backend.model_pool import shared_model_pool, checkpoint_mb
+from src.backend_helpers.hashing import file_hash, text_hash
 
 
 class ImageProcess():
     def __init__(self):
-        model_path , model_config_path = FileManager().get_model_path('detector')
-        self.yolo = YoloDetector(yolo_path=model_path)
+        file_manager = FileManager()
+        settings = file_manager.get_model_settings('detector')
+
+        #the detector is built on first use (normally on the detection thread), so constructing
+        #ImageProcess never blocks the UI on a checkpoint load
+        self._yolo = None
+        self._signature = None
+        self.detector_settings = settings
+
+        self.detection_cache = None
+        if settings.get('detection_cache', True):
+            self.detection_cache = DetectionCache(file_manager.models_dir / "detection_cache.sqlite",
+                                                  max_entries=settings.get('detection_cache_entries', 2000))
         self.yolo_result = None
         self.images_with_boundingbox = None
         self.no_of_boundingbox = None
 
+    @property
+    def yolo(self):
+        if self._yolo is None:
+            settings = self.detector_settings
+            if settings.get('workers', 1) > 1:
+                #cpu build servers: shard images over worker processes, each with its own model
+                self._yolo = ProcessPoolDetector(workers=settings['workers'],
+                                                 threads_per_worker=settings.get('threads_per_worker'),
+                                                 batch_size=settings.get('batch_size', 8))
+            else:
+                #lazy: the weights load on the first detection that misses the cache, already warm
+                #when MainWindow preloaded them into the model pool
+                self._yolo = self.build_detector(FileManager(), lazy=True)
+        return self._yolo
+
+
+    @staticmethod
+    def build_detector(file_manager,overrides=None,lazy=False):
+        settings = file_manager.get_model_settings('detector')
+
+        if file_manager.has_model('detector_small'):
+            #cascade: small model first, the configured detector only for uncertain images
+            return CascadeDetector(ImageProcess._build_detector(file_manager, 'detector_small', overrides, lazy),
+                                   ImageProcess._build_detector(file_manager, 'detector', overrides, lazy=True),
+                                   escalate_below=settings.get('cascade_threshold', 0.8))
+
+        return ImageProcess._build_detector(file_manager, 'detector', overrides, lazy)
+
+
+    @staticmethod
+    def detector_signature(file_manager):
+        #the cache signature build_detector's detector would have, from the settings alone so a fully
+        #cached image set never builds (or exports/loads) a detector
+        def signature(model_type):
+            model_path, backend, _, detector_kwargs = ImageProcess._detector_config(file_manager, model_type)
+            return YoloDetector.make_signature(model_path, backend, **detector_kwargs)
+
+        if file_manager.has_model('detector_small'):
+            settings = file_manager.get_model_settings('detector')
+            return CascadeDetector.make_signature(settings.get('cascade_threshold', 0.8),
+                                                  signature('detector_small'), signature('detector'))
+        return signature('detector')
+
+
+    @staticmethod
+    def _detector_config(file_manager,model_type,overrides=None,lazy=False):
+        model_path , model_config_path , backend = file_manager.get_model_path(model_type, resolve_backend=True)
+        #a model entry without its own settings uses the detector ones
+        settings = file_manager.get_model_settings(model_type) or file_manager.get_model_settings('detector')
+        settings = {**settings, **(overrides or {})}
+        detector_kwargs = dict(batch_size=settings.get('batch_size', 8),
+                               imgsz=settings.get('imgsz', 640),
+                               stream=settings.get('stream', True),
+                               num_threads=settings.get('num_threads'),
+                               slice_size=settings.get('slice_size'),
+                               slice_overlap=settings.get('slice_overlap', 0.2),
+                               prefetch=settings.get('prefetch', True),
+                               prefetch_workers=settings.get('prefetch_workers', 4),
+                               lazy=lazy)
+        return model_path, backend, settings, detector_kwargs
+
+
+    @staticmethod
+    def _build_detector(file_manager,model_type,overrides=None,lazy=False):
+        model_path, backend, settings, detector_kwargs = ImageProcess._detector_config(file_manager, model_type, overrides, lazy)
+
+        def load():
+            if backend == 'onnx':
+                try:
+                    #onnxruntime is optional, only imported when this backend is picked
+                    from src.backend.onnx_detector import OnnxYoloDetector
+                    detector = OnnxYoloDetector(yolo_path=model_path,
+                                                export_dir=file_manager.models_dir,
+                                                intra_op_threads=settings.get('intra_op_threads'),
+                                                inter_op_threads=settings.get('inter_op_threads'),
+                                                **{**detector_kwargs, 'lazy': True})
+                    #export and session are checked here even for lazy callers, so a failure can
+                    #still fall back to torch (an onnx session is cheap next to the torch load)
+                    detector.ensure_loaded()
+                    return detector
+                except Exception as e:
+                    print(f"ONNX detector failed ({e}), falling back to the torch detector")
+
+            return YoloDetector(yolo_path=model_path, **detector_kwargs)
+
+        #a detector with the same weights and settings is reused from the pool, lazy only decides
+        #whether this caller needs the weights loaded right away
+        key = text_hash('detector', model_path, backend, sorted(settings.items()))
+        detector = shared_model_pool().acquire(key, load, checkpoint_mb(model_path))
+        if not lazy:
+            detector.ensure_loaded()
+        return detector
+
+
     def object_detection(self,image_path):
-        self.yolo_result = self.yolo.object_detection(image_path)
+        self.yolo_result = self.cached_object_detection(image_path)
         return self.update_img_with_yolo_boundingbox(image_path)
 
 
+    def iter_object_detection(self,image_paths):
+        #yields (image_name, (image, box count, boxes)) per image as soon as it is ready
+        self.yolo_result = {}
+        for image_name, detections in self._iter_cached_detections(image_paths):
+            self.yolo_result[image_name] = detections
+            yield image_name, self.draw_yolo_boundingbox(detections.image_path, detections)
+
+
+    def cached_object_detection(self,image_paths):
+        return dict(self._iter_cached_detections(image_paths))
+
+
+    def _iter_cached_detections(self,image_paths):
+        #only images whose content (or the model/thresholds) changed reach YOLO, cache hits come out first
+        if self.detection_cache is None:
+            for detections in self.yolo.iter_object_detection(image_paths):
+                yield detections.image_name, detections
+            return
+
+        if self._signature is None:
+            self._signature = self.detector_signature(FileManager())
+        signature = self._signature
+        pending = {}
+        hits = 0
+
+        for img_path in image_paths:
+            key = text_hash(file_hash(img_path), signature)
+            cached = self.detection_cache.get(key, img_path)
+            if cached is not None:
+                hits += 1
+                yield Path(img_path).stem, cached
+            else:
+                pending[Path(img_path).stem] = key
+
+        print(f" Detection cache: {hits} hits, {len(pending)} to detect")
+
+        if pending:
+            to_detect = [img_path for img_path in image_paths if Path(img_path).stem in pending]
+            #a detector that fell back to another backend stores its results under its own signature
+            if self.yolo.cache_signature() != signature:
+                pending = {Path(img_path).stem: text_hash(file_hash(img_path), self.yolo.cache_signature()) for img_path in to_detect}
+            for detections in self.yolo.iter_object_detection(to_detect):
+                self.detection_cache.put(pending[detections.image_name], detections)
+                yield detections.image_name, detections
+
+
     def update_img_with_yolo_boundingbox(self, image_paths):
         img_with_boundingbox = {}
         for img_path in image_paths:
-            img_boxes = []
             image_name = Path(img_path).stem
             
             # Check if this image has detections in yolo_result
-            if image_name in self.yolo_result:
-                # Directly get boxes from the detection list
-                detections = self.yolo_result[image_name]
-                img_boxes = [detection['box'] for detection in detections]
-            
-            # Load image and draw boxes
-            image = cv2.imread(img_path)
-            for (x1, y1, x2, y2) in img_boxes:
-                h, w = image.shape[:2]
-                avg_dim = (w + h) / 2
-                thickness = max(1, int(avg_dim / 500))
-
-                cv2.rectangle(image, (x1, y1), (x2, y2), (0, 255, 0), thickness)
-            
-            img_with_boundingbox[f'{image_name}']=(image,len(img_boxes),img_boxes)
+            detections = self.yolo_result.get(image_name)
+            img_with_boundingbox[f'{image_name}'] = self.draw_yolo_boundingbox(img_path, detections)
         
         return img_with_boundingbox
+
+
+    def draw_yolo_boundingbox(self, img_path, detections):
+        # Boxes come straight from the columnar xyxy array
+        img_boxes = detections.boxes() if detections is not None else []
+            
+        # Load image and draw boxes
+        image = cv2.imread(img_path)
+        for (x1, y1, x2, y2) in img_boxes:
+            h, w = image.shape[:2]
+            avg_dim = (w + h) / 2
+            thickness = max(1, int(avg_dim / 500))
+
+            cv2.rectangle(image, (x1, y1), (x2, y2), (0, 255, 0), thickness)
+
+        #detections rides along so later stages can use confidences/classes of the boxes
+        return (image,len(img_boxes),img_boxes,detections)
         
 
     def update_img_with_manual_boundigbox(self,image,box_coordinates):
@@ -60,7 +218,10 @@ class ImageProcess():
 
     def _del_device(self):
         #Clean up when ImageProcess is destroyed
-        if hasattr(self, 'yolo'):
-            self.yolo.close()
+        if self._yolo is not None:
+            self._yolo.close()
+            self._yolo = None
+        if self.detection_cache is not None:
+            self.detection_cache.close()
 
 
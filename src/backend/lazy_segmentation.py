@@ -0,0 +1,45 @@
+from src.backend.packed_object import read_source
+
+
+
+class LazySegmentation():
+    #Confirmed boxes that are segmented one object at a time, in whatever order the viewer asks for them.
+    #items uses the segment_many layout: {image_name: {'image_path','bbox','point_coords','point_labels'}}
+    def __init__(self,loader,items,**kwargs):
+        self.loader = loader
+        self.items = items
+        self.kwargs = kwargs
+        self.sam = None
+        #objects stay grouped per image, so the default order reuses each image embedding
+        self.requests = {obj: image_name for image_name, item in items.items() for obj in item['bbox']}
+
+
+    def object_names(self):
+        return list(self.requests)
+
+
+    def object_size(self,object_name):
+        x1,y1,x2,y2 = self.items[self.requests[object_name]]['bbox'][object_name]
+        return (x2 - x1, y2 - y1)
+
+
+    def segment(self,object_name):
+        #the model is loaded by the first request, on the worker thread
+        if self.sam is None:
+            self.sam = self.loader()
+
+        item = self.items[self.requests[object_name]]
+        image_path = item['image_path']
+        objects = self.sam.segmented_objects(image_path,{object_name: item['bbox'][object_name]},
+                                             image=read_source(image_path),
+                                             point_coords=item.get('point_coords'),
+                                             point_labels=item.get('point_labels'),
+                                             **self.kwargs)
+        return objects[object_name]
+
+
+    def close(self):
+        if self.sam is not None:
+            print(self.sam.timing_report())
+            self.sam.close()
+            self.sam = None
@@ -0,0 +1,72 @@
+from collections import OrderedDict
+import numpy as np
+import threading
+
+from src.backend_helpers.hashing import text_hash
+
+
+
+class MaskCache():
+    #Final segmented objects in memory, keyed by everything that decides the mask: image content,
+    #model, box, the prompts inside that box, multimask and the output format. Least recently used go first
+    def __init__(self,max_mb=512):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+
+    @staticmethod
+    def make_key(image_hash,model_signature,box,point_coords,point_labels,multimask_output,output='bgra'):
+        #only the points inside the box change its mask, sorted so click order does not matter
+        x1,y1,x2,y2 = (int(v) for v in box)
+        prompts = []
+        if point_coords is not None and len(point_coords):
+            for (x,y),label in zip(np.asarray(point_coords).tolist(), np.asarray(point_labels).tolist()):
+                if x1 <= x <= x2 and y1 <= y <= y2:
+                    prompts.append((round(x,2), round(y,2), int(label)))
+        return text_hash(image_hash, model_signature, (x1,y1,x2,y2), sorted(prompts), bool(multimask_output), output)
+
+
+    def get(self,key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                return None
+            self.entries.move_to_end(key)
+        #packed objects are never modified, dense arrays are handed out as copies
+        return value.copy() if isinstance(value, np.ndarray) else value
+
+
+    def put(self,key,value):
+        if isinstance(value, np.ndarray):
+            value = value.copy()
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= self.entries.pop(key).nbytes
+            self.entries[key] = value
+            self.total_bytes += value.nbytes
+
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                _, evicted = self.entries.popitem(last=False)
+                self.total_bytes -= evicted.nbytes
+
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+
+
+_shared_cache = None
+_shared_lock = threading.Lock()
+
+
+def shared_mask_cache(max_mb=512):
+    #one cache for the whole session, so reopening the assert window keeps earlier objects
+    global _shared_cache
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = MaskCache(max_mb)
+        return _shared_cache
@@ -0,0 +1,141 @@
+from collections import OrderedDict
+import threading
+import time
+import os
+
+
+
+class PoolEntry():
+    __slots__ = ('model', 'refs', 'size_mb', 'last_used')
+
+    def __init__(self,model,size_mb):
+        self.model = model
+        self.refs = 1
+        self.size_mb = size_mb
+        self.last_used = time.monotonic()
+
+
+
+class ModelPool():
+    #Process wide registry of loaded detector/segmentor objects. acquire() hands out the resident
+    #object for a key (loading it once), close() on a pooled object only releases its reference.
+    #Unreferenced models stay loaded until the memory budget needs room (least recently used first)
+    #or they sat idle for idle_timeout seconds
+    def __init__(self,budget_mb=4096,idle_timeout=600):
+        self.budget_mb = budget_mb
+        self.idle_timeout = idle_timeout
+        self.entries = OrderedDict()
+        self.lock = threading.RLock()
+        self.key_locks = {}
+        self.idle_thread = None
+
+
+    def acquire(self,key,loader,size_mb=0):
+        #one loader per key at a time, a second caller waits and gets the same object
+        with self.lock:
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self.lock:
+                entry = self.entries.get(key)
+                if entry is not None:
+                    entry.refs += 1
+                    entry.last_used = time.monotonic()
+                    self.entries.move_to_end(key)
+                    return entry.model
+
+            model = loader()
+            model.pool_key = key
+
+            with self.lock:
+                self.entries[key] = PoolEntry(model, size_mb)
+                self._fit_budget()
+                self._start_idle_thread()
+            return model
+
+
+    def release(self,key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return
+            entry.refs = max(0, entry.refs - 1)
+            entry.last_used = time.monotonic()
+            self._fit_budget()
+
+
+    def loaded_mb(self):
+        with self.lock:
+            return sum(entry.size_mb for entry in self.entries.values())
+
+
+    def _fit_budget(self):
+        #least recently used unreferenced models go until the pool fits, models in use are never unloaded
+        total = sum(entry.size_mb for entry in self.entries.values())
+        for key in list(self.entries):
+            if total <= self.budget_mb:
+                break
+            entry = self.entries[key]
+            if entry.refs == 0:
+                total -= entry.size_mb
+                self._unload(key)
+
+
+    def unload_idle(self):
+        now = time.monotonic()
+        with self.lock:
+            for key, entry in list(self.entries.items()):
+                if entry.refs == 0 and now - entry.last_used >= self.idle_timeout:
+                    self._unload(key)
+
+
+    def _unload(self,key):
+        entry = self.entries.pop(key)
+        print(f"Unloading pooled model: {type(entry.model).__name__} ({entry.size_mb:.0f} MB)")
+        #without its key close() really frees the model
+        entry.model.pool_key = None
+        entry.model.close()
+
+
+    def clear(self):
+        with self.lock:
+            for key in list(self.entries):
+                self._unload(key)
+
+
+    def _start_idle_thread(self):
+        if self.idle_thread is not None or not self.idle_timeout:
+            return
+
+        def watch():
+            while True:
+                time.sleep(max(1, min(30, self.idle_timeout / 2)))
+                self.unload_idle()
+
+        self.idle_thread = threading.Thread(target=watch, name="model-pool-idle", daemon=True)
+        self.idle_thread.start()
+
+
+
+def checkpoint_mb(path):
+    #file size is the memory estimate for a pooled model
+    try:
+        return os.path.getsize(path) / (1024 * 1024)
+    except OSError:
+        return 0
+
+
+_shared_pool = None
+_shared_lock = threading.Lock()
+
+
+def shared_model_pool():
+    #configured from the optional "model_pool" block of models_config.json on first use
+    global _shared_pool
+    with _shared_lock:
+        if _shared_pool is None:
+            from src.backend.file_manager import FileManager
+            settings = FileManager().get_pool_settings()
+            _shared_pool = ModelPool(budget_mb=settings.get('budget_mb', 4096),
+                                     idle_timeout=settings.get('idle_timeout', 600))
+        return _shared_pool
@@ -0,0 +1,131 @@
+from ultralytics import YOLO
+from pathlib import Path
+import onnxruntime as ort
+import numpy as np
+import shutil
+import ast
+
+from src.backend.yolo_detector import YoloDetector
+from src.backend import box_operations as box_ops
+from src.backend.image_prefetcher import letterbox_batch, read_image, stride_ceil
+from src.backend_helpers.hashing import file_hash
+
+
+
+class OnnxYoloDetector(YoloDetector):
+    #Same detector api, inference through ONNX Runtime on the CPU execution provider
+    backend = 'onnx'
+    load_stages = ('session',)
+
+    def __init__(self,yolo_path,export_dir=None,intra_op_threads=None,inter_op_threads=None,max_det=300,**kwargs):
+        self.export_dir = Path(export_dir) if export_dir else Path(yolo_path).parent
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.max_det = max_det
+        self.session = None
+        self.input_name = None
+        self._names = None
+        super().__init__(yolo_path,**kwargs)
+
+
+    def set_device(self):
+        self.device = 'cpu'
+        print(f"Using device: {self.device} (onnxruntime)")
+
+
+    def export_path(self):
+        #one export per model content + input size, kept next to models_config.json
+        return self.export_dir / f"{Path(self.path).stem}.{file_hash(self.path)[:12]}.{self.imgsz}.onnx"
+
+
+    def _export(self, onnx_path):
+        print(f" Exporting {Path(self.path).name} to ONNX (one time)...")
+        exported = YOLO(self.path).export(format='onnx', imgsz=self.imgsz, dynamic=True, simplify=False, half=False, device='cpu')
+        shutil.move(str(exported), str(onnx_path))
+
+
+    def _load_stage(self,stage):
+        #export (one time) and session creation are a single stage
+        self._load_device()
+
+
+    def _load_device(self):
+        try:
+            print("🎬 Loading ONNX detector...")
+            onnx_path = self.export_path()
+            if not onnx_path.exists():
+                self._export(onnx_path)
+
+            options = ort.SessionOptions()
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            if self.intra_op_threads:
+                options.intra_op_num_threads = int(self.intra_op_threads)
+            if self.inter_op_threads:
+                options.inter_op_num_threads = int(self.inter_op_threads)
+
+            self.session = ort.InferenceSession(str(onnx_path), sess_options=options, providers=['CPUExecutionProvider'])
+            self.input_name = self.session.get_inputs()[0].name
+
+            #ultralytics writes the class names into the model metadata
+            metadata = self.session.get_modelmeta().custom_metadata_map
+            self._names = ast.literal_eval(metadata['names']) if 'names' in metadata else {}
+
+            self._warmup()
+            print(f" Models loaded on {self.device} from {onnx_path.name}")
+        except Exception as e:
+            print(f" Error loading models: {e}")
+            raise
+
+    def _warmup(self):
+        dummy = np.zeros((1, 3, self.imgsz, self.imgsz), dtype=np.float32)
+        self.session.run(None, {self.input_name: dummy})
+
+    def _del_device(self):
+        self.session = None
+        self.loaded = False
+
+
+    @property
+    def names(self):
+        self.ensure_loaded()
+        return self._names
+
+
+    def _run(self, batch):
+        return self.session.run(None, {self.input_name: batch})[0]
+
+
+    def _predict(self, sources, imgsz):
+        #the export has dynamic height/width, so tiles run at their own size (imgsz=slice_size)
+        #instead of being shrunk to the export size
+        images = [read_image(src) if isinstance(src, str) else src for src in sources]
+        batch, metas = letterbox_batch(images, stride_ceil(imgsz))
+
+        for preds, meta in zip(self._run(batch), metas):
+            yield self._postprocess(preds, *meta)
+
+
+    def _predict_prefetched(self, batch):
+        for preds, meta in zip(self._run(batch.array), batch.metas):
+            yield self._postprocess(preds, *meta)
+
+
+    def _postprocess(self, preds, orig_hw, ratio, pad):
+        #preds is (4+nc, anchors): cx,cy,w,h followed by per class scores
+        preds = preds.T
+        scores = preds[:, 4:]
+        cls = scores.argmax(axis=1)
+        conf = scores[np.arange(len(scores)), cls]
+
+        keep = conf >= self.conf
+        if not keep.any():
+            return np.empty((0, 6), dtype=np.float32)
+
+        cxcywh, conf, cls = preds[keep, :4], conf[keep], cls[keep]
+        xyxy = np.concatenate([cxcywh[:, :2] - cxcywh[:, 2:] / 2, cxcywh[:, :2] + cxcywh[:, 2:] / 2], axis=1)
+
+        keep = box_ops.nms(xyxy, conf, self.iou, classes=cls)[:self.max_det]
+        xyxy = box_ops.unletterbox_boxes(xyxy[keep], orig_hw, ratio, pad)
+
+        return np.concatenate([xyxy, conf[keep, None], cls[keep, None]], axis=1).astype(np.float32)
+
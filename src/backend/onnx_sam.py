@@ -0,0 +1,285 @@
+from sam2.build_sam import build_sam2
+from pathlib import Path
+import onnxruntime as ort
+import numpy as np
+import torch
+import cv2
+import gc
+import os
+
+from src.backend.sam_detector import SamExtractor
+from src.backend_helpers.hashing import file_hash, text_hash
+
+
+
+class _EncoderExport(torch.nn.Module):
+    #image encoder + the feature reshaping SAM2ImagePredictor.set_image does after it
+    def __init__(self,model):
+        super().__init__()
+        self.model = model
+
+    def forward(self,image):
+        backbone_out = self.model.forward_image(image)
+        _, vision_feats, _, feat_sizes = self.model._prepare_backbone_features(backbone_out)
+        if self.model.directly_add_no_mem_embed:
+            vision_feats[-1] = vision_feats[-1] + self.model.no_mem_embed
+
+        feats = [feat.permute(1, 2, 0).reshape(image.shape[0], -1, *size) for feat, size in zip(vision_feats, feat_sizes)]
+        return feats[-1], feats[0], feats[1]
+
+
+
+class _DecoderExport(torch.nn.Module):
+    #prompt encoder + mask decoder, boxes arrive as two corner points labelled 2 and 3
+    def __init__(self,model,multimask_output):
+        super().__init__()
+        self.model = model
+        self.multimask_output = multimask_output
+
+    def forward(self,image_embed,high_res_0,high_res_1,point_coords,point_labels):
+        sparse_embeddings, dense_embeddings = self.model.sam_prompt_encoder(points=(point_coords, point_labels), boxes=None, masks=None)
+        low_res_masks, iou_predictions, _, _ = self.model.sam_mask_decoder(
+            image_embeddings=image_embed,
+            image_pe=self.model.sam_prompt_encoder.get_dense_pe(),
+            sparse_prompt_embeddings=sparse_embeddings,
+            dense_prompt_embeddings=dense_embeddings,
+            multimask_output=self.multimask_output,
+            repeat_image=True,
+            high_res_features=[high_res_0, high_res_1])
+        return low_res_masks, iou_predictions
+
+
+
+class OnnxSam2Predictor():
+    #The part of SAM2ImagePredictor SamExtractor uses (set_image, set_image_batch, predict and the
+    #_features/_orig_hw state), running the exported encoder/decoder with numpy arrays
+    mean = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+    std = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+    def __init__(self,encoder,decoders,resolution=1024,mask_threshold=0.0):
+        self.encoder = encoder
+        self.decoders = decoders
+        self.resolution = resolution
+        self.mask_threshold = mask_threshold
+        self.reset_predictor()
+
+
+    def reset_predictor(self):
+        self._features = None
+        self._orig_hw = []
+        self._is_image_set = False
+        self._is_batch = False
+
+
+    def _preprocess(self,image):
+        #same as SAM2Transforms: square resize to the model resolution, scale to 0-1 and normalize
+        resized = cv2.resize(image, (self.resolution, self.resolution), interpolation=cv2.INTER_LINEAR)
+        normalized = (resized.astype(np.float32) / 255 - self.mean) / self.std
+        return normalized.transpose(2, 0, 1)
+
+
+    def _encode(self,images):
+        batch = np.ascontiguousarray(np.stack([self._preprocess(image) for image in images]))
+        image_embed, high_res_0, high_res_1 = self.encoder.run(None, {'image': batch})
+        self._features = {"image_embed": image_embed, "high_res_feats": [high_res_0, high_res_1]}
+        self._orig_hw = [tuple(image.shape[:2]) for image in images]
+        self._is_image_set = True
+
+
+    def set_image(self,image):
+        self.reset_predictor()
+        self._encode([image])
+        self._is_batch = False
+
+
+    def set_image_batch(self,images):
+        self.reset_predictor()
+        self._encode(images)
+        self._is_batch = True
+
+
+    def predict(self,point_coords=None,point_labels=None,box=None,mask_input=None,
+                multimask_output=True,return_logits=False,normalize_coords=True):
+        if mask_input is not None:
+            raise NotImplementedError("mask_input is not supported by the ONNX SAM2 backend")
+
+        low_res_masks, iou_predictions = self.predict_low_res(point_coords, point_labels, box,
+                                                              multimask_output, normalize_coords)
+
+        #bilinear upscale of the 256x256 logits to the original size (align_corners=False, like F.interpolate)
+        height, width = self._orig_hw[0]
+        masks = np.empty((*low_res_masks.shape[:2], height, width), dtype=np.float32 if return_logits else bool)
+        for n in range(low_res_masks.shape[0]):
+            for m in range(low_res_masks.shape[1]):
+                upscaled = cv2.resize(low_res_masks[n, m], (width, height), interpolation=cv2.INTER_LINEAR)
+                masks[n, m] = upscaled if return_logits else upscaled > self.mask_threshold
+
+        low_res_masks = np.clip(low_res_masks, -32.0, 32.0)
+        squeeze = lambda array: array[0] if array.shape[0] == 1 else array
+        return squeeze(masks), squeeze(iou_predictions), squeeze(low_res_masks)
+
+
+    def predict_low_res(self,point_coords=None,point_labels=None,box=None,multimask_output=True,normalize_coords=True):
+        #decoder only, (N,C,256,256) logits and (N,C) scores without the upscale to the original size
+        if not self._is_image_set or self._is_batch:
+            raise RuntimeError("An image must be set with .set_image(...) before mask prediction.")
+
+        height, width = self._orig_hw[0]
+        coords, labels = [], []
+        if box is not None:
+            box = np.asarray(box, dtype=np.float32).reshape(-1, 2, 2)
+            coords.append(box)
+            labels.append(np.tile(np.array([[2, 3]], dtype=np.float32), (len(box), 1)))
+        if point_coords is not None:
+            point_coords = np.asarray(point_coords, dtype=np.float32)
+            point_labels = np.asarray(point_labels, dtype=np.float32)
+            if point_coords.ndim == 2:
+                point_coords, point_labels = point_coords[None], point_labels[None]
+            coords.append(point_coords)
+            labels.append(point_labels)
+
+        coords = np.concatenate(coords, axis=1)
+        labels = np.concatenate(labels, axis=1)
+        if normalize_coords:
+            coords = coords * np.array([self.resolution / width, self.resolution / height], dtype=np.float32)
+
+        image_embed = self._features["image_embed"]
+        high_res_0, high_res_1 = self._features["high_res_feats"]
+        return self.decoders[bool(multimask_output)].run(None, {
+            'image_embed': np.ascontiguousarray(image_embed, dtype=np.float32),
+            'high_res_0': np.ascontiguousarray(high_res_0, dtype=np.float32),
+            'high_res_1': np.ascontiguousarray(high_res_1, dtype=np.float32),
+            'point_coords': np.ascontiguousarray(coords),
+            'point_labels': np.ascontiguousarray(labels)})
+
+
+
+class OnnxSamExtractor(SamExtractor):
+    #Same segmentation api, SAM2 encoder and decoder exported to ONNX and run on the CPU execution provider
+    backend = 'onnx'
+
+    def __init__(self,sam_path,sam_model_config,export_dir=None,intra_op_threads=None,inter_op_threads=None,**kwargs):
+        self.export_dir = Path(export_dir) if export_dir else Path(sam_path).parent
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        super().__init__(sam_path,sam_model_config,**kwargs)
+
+
+    def set_device(self):
+        self.device = 'cpu'
+        print(f"Using device: {self.device} (onnxruntime)")
+
+
+    def export_paths(self):
+        #one set of exports per checkpoint content, kept next to the checkpoint
+        stem = f"{Path(self.path).stem}.{file_hash(self.path)[:12]}"
+        return {'encoder': self.export_dir / f"{stem}.encoder.onnx",
+                True: self.export_dir / f"{stem}.decoder_multimask.onnx",
+                False: self.export_dir / f"{stem}.decoder_single.onnx"}
+
+
+    def _export(self,paths):
+        print(f" Exporting {Path(self.path).name} to ONNX (one time)...")
+        model = build_sam2(config_file=self.model_type,ckpt_path=self.path,device='cpu')
+        resolution = model.image_size
+
+        with torch.no_grad():
+            encoder = _EncoderExport(model).eval()
+            dummy_image = torch.zeros(1, 3, resolution, resolution)
+            image_embed, high_res_0, high_res_1 = encoder(dummy_image)
+            self._export_module(encoder, (dummy_image,), paths['encoder'],
+                                ['image'], ['image_embed', 'high_res_0', 'high_res_1'],
+                                {'image': {0: 'batch'}, 'image_embed': {0: 'batch'},
+                                 'high_res_0': {0: 'batch'}, 'high_res_1': {0: 'batch'}})
+
+            dummy_coords = torch.zeros(1, 3, 2)
+            dummy_labels = torch.tensor([[2, 3, 1]], dtype=torch.float32)
+            for multimask_output in (True, False):
+                self._export_module(_DecoderExport(model, multimask_output).eval(),
+                                    (image_embed, high_res_0, high_res_1, dummy_coords, dummy_labels),
+                                    paths[multimask_output],
+                                    ['image_embed', 'high_res_0', 'high_res_1', 'point_coords', 'point_labels'],
+                                    ['low_res_masks', 'iou_predictions'],
+                                    {'point_coords': {0: 'boxes', 1: 'points'}, 'point_labels': {0: 'boxes', 1: 'points'},
+                                     'low_res_masks': {0: 'boxes'}, 'iou_predictions': {0: 'boxes'}})
+
+        del model
+        gc.collect()
+
+
+    @staticmethod
+    def _export_module(module,args,path,input_names,output_names,dynamic_axes):
+        #written under a temp name and renamed, so an interrupted export is never loaded
+        tmp_path = path.with_suffix('.tmp')
+        torch.onnx.export(module, args, str(tmp_path), input_names=input_names, output_names=output_names,
+                          dynamic_axes=dynamic_axes, opset_version=17)
+        os.replace(tmp_path, path)
+
+
+    @staticmethod
+    def _quantized(path):
+        #dynamic int8 weights for MatMul/Gemm, converted once and kept beside the fp32 export
+        quantized_path = path.with_suffix('.int8.onnx')
+        if not quantized_path.exists():
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+            print(f" Quantizing {path.name} to int8 (one time)...")
+            tmp_path = quantized_path.with_suffix('.tmp')
+            quantize_dynamic(str(path), str(tmp_path), weight_type=QuantType.QInt8)
+            os.replace(tmp_path, quantized_path)
+        return quantized_path
+
+
+    def _session(self,path):
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if self.intra_op_threads:
+            options.intra_op_num_threads = int(self.intra_op_threads)
+        if self.inter_op_threads:
+            options.inter_op_num_threads = int(self.inter_op_threads)
+        return ort.InferenceSession(str(path), sess_options=options, providers=['CPUExecutionProvider'])
+
+
+    def load_device(self):
+        try:
+            print("🎬 Loading ONNX models for object extraction...")
+            paths = self.export_paths()
+            if not all(path.exists() for path in paths.values()):
+                self._export(paths)
+
+            if self.precision == 'int8':
+                paths = {key: self._quantized(path) for key, path in paths.items()}
+            elif self.precision != 'fp32':
+                print(f"{self.precision} is not available with onnxruntime, using fp32")
+                self.precision = 'fp32'
+
+            self.predictor = OnnxSam2Predictor(self._session(paths['encoder']),
+                                               {True: self._session(paths[True]), False: self._session(paths[False])})
+            print(f" Models loaded on {self.device} from {paths['encoder'].name}")
+        except Exception as e:
+            print(f" Error loading models: {e}")
+            raise
+
+
+    def _del_device(self):
+        self.predictor = None
+        self.embedded_image = None
+        gc.collect()
+
+
+    def model_signature(self):
+        #ONNX embeddings differ slightly from torch ones, so they get their own cache entries
+        if self._model_signature is None:
+            self._model_signature = text_hash(super().model_signature(), self.backend)
+        return self._model_signature
+
+
+    def _decode_low_res(self,box,point_coords,point_labels,multimask_output):
+        return self.predictor.predict_low_res(point_coords,point_labels,box,multimask_output)
+
+
+    def _feature_array(self,feature):
+        return np.asarray(feature, dtype=np.float32)
+
+
+    def _to_device(self,array):
+        return np.ascontiguousarray(array, dtype=np.float32)
@@ -0,0 +1,132 @@
+import cv2
+import numpy as np
+import threading
+
+
+
+def refine_mask(mask,ksize=(7,7),sigmaX=0,sigmaY=0,kernel_shape=cv2.MORPH_ELLIPSE,kernel_size=(5,5)):
+    #gaussian blur + two closings, smooths SAM's stair stepped mask edges
+
+    mask_float = mask.astype(np.float32) / 255
+    mask_gauss_blur = cv2.GaussianBlur(mask_float, ksize, sigmaX, sigmaY)
+    mask_gauss_blur_uint8 = np.round(mask_gauss_blur*255).astype(np.uint8)
+
+    kernel = cv2.getStructuringElement(kernel_shape,kernel_size)
+    mask_morph = cv2.morphologyEx(mask_gauss_blur_uint8, cv2.MORPH_CLOSE, kernel)
+    mask_morph = cv2.morphologyEx(mask_morph,cv2.MORPH_CLOSE,kernel)
+
+    return mask_morph
+
+
+def compose_object(image,roi_mask,roi,box):
+    #refines a mask covering roi (box plus margin) and returns the BGRA crop of box
+
+    x1,y1,x2,y2 = box
+    rx1,ry1,_,_ = roi
+    refined_mask = refine_mask(roi_mask)
+
+    # Ensure mask is valid alpha
+    alpha = refined_mask.astype(np.uint8)
+    if alpha.max() <= 1:
+        alpha = alpha * 255
+
+    # Put refined mask into alpha channel of the cropped image
+    object_rgba = cv2.cvtColor(image[y1:y2, x1:x2], cv2.COLOR_BGR2BGRA)
+    object_rgba[:, :, 3] = alpha[y1 - ry1:y2 - ry1, x1 - rx1:x2 - rx1]
+
+    return object_rgba
+
+
+
+_source_lock = threading.Lock()
+_source_image = (None, None)
+
+
+def read_source(image_path):
+    #objects of one image are usually materialized one after another, so the last source image is kept
+    global _source_image
+    with _source_lock:
+        path, image = _source_image
+        if path == image_path:
+            return image
+
+    image = cv2.imread(image_path)
+    if image is None:
+        raise FileNotFoundError(f"Could not read image at path: {image_path}")
+
+    with _source_lock:
+        _source_image = (image_path, image)
+    return image
+
+
+
+class PackedObject():
+    #A segmented object without pixels: source image path, bbox, the raw binary SAM mask over
+    #box + margin packed to 1 bit per pixel, and the prompts it was made from. to_bgra() rebuilds
+    #the same BGRA crop segmented_objects returns, the refinement is rerun on the unpacked mask
+    __slots__ = ('image_path', 'bbox', 'roi', 'bits', 'point_coords', 'point_labels')
+
+    def __init__(self,image_path,bbox,roi,bits,point_coords=None,point_labels=None):
+        self.image_path = image_path
+        self.bbox = tuple(int(v) for v in bbox)
+        self.roi = tuple(int(v) for v in roi)
+        self.bits = bits
+        self.point_coords = [] if point_coords is None else point_coords
+        self.point_labels = [] if point_labels is None else point_labels
+
+
+    @classmethod
+    def from_mask(cls,image_path,mask,box,margin=16,point_coords=None,point_labels=None):
+        #mask is the full frame SAM mask, only box + margin is kept
+        x1,y1,x2,y2 = box
+        height, width = mask.shape[:2]
+        roi = (max(0, x1 - margin), max(0, y1 - margin), min(width, x2 + margin), min(height, y2 + margin))
+        rx1,ry1,rx2,ry2 = roi
+        return cls.from_roi_mask(image_path, mask[ry1:ry2, rx1:rx2], roi, box, point_coords, point_labels)
+
+
+    @classmethod
+    def from_roi_mask(cls,image_path,roi_mask,roi,box,point_coords=None,point_labels=None):
+        #roi_mask already covers only roi (box + margin)
+        x1,y1,x2,y2 = box
+        bits = np.packbits(roi_mask > 0)
+
+        #keeps only the prompts that shaped this object
+        coords = np.asarray(point_coords if point_coords is not None else [], dtype=np.float32).reshape(-1, 2)
+        labels = np.asarray(point_labels if point_labels is not None else [], dtype=np.float32)
+        inside = (coords[:, 0] >= x1) & (coords[:, 0] <= x2) & (coords[:, 1] >= y1) & (coords[:, 1] <= y2)
+
+        return cls(image_path, box, roi, bits,
+                   coords[inside].tolist(), labels[inside].astype(int).tolist() if len(labels) else [])
+
+
+    @property
+    def shape(self):
+        x1,y1,x2,y2 = self.bbox
+        return (y2 - y1, x2 - x1, 4)
+
+
+    @property
+    def nbytes(self):
+        return self.bits.nbytes
+
+
+    def roi_mask(self):
+        rx1,ry1,rx2,ry2 = self.roi
+        height, width = ry2 - ry1, rx2 - rx1
+        return np.unpackbits(self.bits, count=height * width).reshape(height, width) * np.uint8(255)
+
+
+    def to_bgra(self,image=None):
+        image = read_source(self.image_path) if image is None else image
+        return compose_object(image, self.roi_mask(), self.roi, self.bbox)
+
+
+    def __repr__(self):
+        return f"PackedObject({self.image_path!r}, bbox={self.bbox}, {self.nbytes} bytes)"
+
+
+
+def as_bgra(obj):
+    #dense BGRA for either output format
+    return obj.to_bgra() if isinstance(obj, PackedObject) else obj
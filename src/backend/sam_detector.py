@@ -4,17 +4,42 @@ from sam2.build_sam import build_sam2
 from sam2.sam2_image_predictor import SAM2ImagePredictor
 import torch
 import gc
+import os
+import time
+import threading
+import contextlib
+from pathlib import Path
+
+from src.backend_helpers.hashing import file_hash, text_hash
+from src.backend.packed_object import PackedObject, compose_object
+from src.backend.embedding_cache import shared_embedding_cache
+from src.backend.mask_cache import shared_mask_cache
+from src.backend.model_pool import shared_model_pool, checkpoint_mb
 
 
 
 
 class SamExtractor():
-    def __init__(self,sam_path,sam_model_config,gpu_id=None):
+    backend = 'torch'
+
+    def __init__(self,sam_path,sam_model_config,gpu_id=None,embedding_cache=None,mask_cache=None,precision='fp32'):
         self.path = sam_path
         self.gpu_id = gpu_id if gpu_id is not None else 0
         self.model_type = sam_model_config
         self.device = None
         self.model = None
+        self.predictor = None
+        self.embedded_image = None
+        self.embedding_cache = embedding_cache
+        self.mask_cache = mask_cache
+        #'fp32', 'int8' (dynamic int8 Linear layers, cpu only) or 'bf16' (autocast)
+        self.precision = precision
+        self._model_signature = None
+        #set while the model is resident in the model pool
+        self.pool_key = None
+        #the predictor holds one embedding, so encoding and decoding never overlap between threads
+        self.lock = threading.RLock()
+        self.reset_timings()
         self.set_device()
         
 
@@ -39,132 +64,548 @@ class SamExtractor():
     def load_device(self):
         try:
             print("🎬 Loading models for object extraction...")
-            self.model = build_sam2(config_file=self.model_type,ckpt_path=self.path).to('cuda:0')
+            self.precision = self._supported_precision(self.precision)
+            if self.precision == 'int8':
+                self.model = self._load_quantized()
+            else:
+                self.model = build_sam2(config_file=self.model_type,ckpt_path=self.path,device=self.device)
             self.predictor = SAM2ImagePredictor(self.model)
-            print(f" Models loaded on {self.device}")
+            print(f" Models loaded on {self.device} ({self.precision})")
         except Exception as e:
             print(f" Error loading models: {e}")
             raise
 
+
+    def _supported_precision(self,precision):
+        #falls back to fp32 where the requested mode can't run
+        if precision == 'int8' and self.device != 'cpu':
+            print("int8 dynamic quantization only runs on the cpu, using fp32")
+            return 'fp32'
+        if precision == 'bf16' and self.device == 'cpu':
+            try:
+                if not torch.ops.mkldnn._is_mkldnn_bf16_supported():
+                    print("This cpu has no bf16 support, using fp32")
+                    return 'fp32'
+            except Exception as e:
+                print(f"bf16 support check failed, using fp32: {e}")
+                return 'fp32'
+        return precision
+
+
+    def quantized_path(self):
+        return Path(self.path).parent / f"{Path(self.path).stem}.{file_hash(self.path)[:12]}.int8.pt"
+
+
+    def _load_quantized(self):
+        #Linear layers of the image encoder and mask decoder as dynamic int8. The converted weights are
+        #stored next to the checkpoint, later loads skip the fp32 checkpoint and the conversion
+        quantized_path = self.quantized_path()
+        cached = quantized_path.exists()
+        model = build_sam2(config_file=self.model_type,ckpt_path=None if cached else self.path,device='cpu')
+
+        for name in ('image_encoder', 'sam_mask_decoder'):
+            setattr(model, name, torch.ao.quantization.quantize_dynamic(getattr(model, name), {torch.nn.Linear}, dtype=torch.qint8))
+
+        if cached:
+            model.load_state_dict(torch.load(quantized_path, map_location='cpu'))
+        else:
+            print(f" Quantizing {Path(self.path).name} to int8 (one time)...")
+            tmp_path = quantized_path.with_suffix('.tmp')
+            torch.save(model.state_dict(), tmp_path)
+            os.replace(tmp_path, quantized_path)
+
+        return model.eval()
+
+
+    def _inference_context(self):
+        #bf16 autocast around encoder/decoder calls, a no-op for the other modes
+        if self.precision == 'bf16':
+            return torch.autocast(device_type=self.device.split(':')[0], dtype=torch.bfloat16)
+        return contextlib.nullcontext()
+
     def close(self):
-        self._del_device()
+        #pooled models are only released, the pool decides when to unload them
+        if self.pool_key is not None:
+            shared_model_pool().release(self.pool_key)
+        else:
+            self._del_device()
 
     def _del_device(self):
-        del self.model
+        self.model = None
+        self.predictor = None
+        self.embedded_image = None
         gc.collect()
         torch.cuda.empty_cache()
 
-    
-    def segmented_objects(self,image_path, bbox: dict,**kwargs):
 
-        if image_path is not None:
-            image = cv2.imread(image_path)
-            if image is None:
-                raise FileNotFoundError(f"Could not read image at path: {image_path}")
-        else:
-            raise ValueError("image_path cannot be None")     
+    def reset_timings(self):
+        self.timings = {'encoder_calls': 0, 'encoder_time': 0.0, 'encoder_cache_hits': 0,
+                        'decoder_calls': 0, 'decoder_time': 0.0, 'mask_cache_hits': 0,
+                        'refine_time': 0.0}
 
-        # Convert image BGR → BGRA
-        bgra_org = cv2.cvtColor(image, cv2.COLOR_BGR2BGRA)
 
-        pc = kwargs.get("point_coords")
-        point_coords = None if not pc else np.array(pc, dtype=np.float32)
+    def timing_report(self):
+        t = self.timings
+        return (f" SAM timings: encoder {t['encoder_calls']} calls / {t['encoder_time']:.2f}s "
+                f"({t['encoder_cache_hits']} cached), "
+                f"decoder {t['decoder_calls']} calls / {t['decoder_time']:.2f}s "
+                f"({t['mask_cache_hits']} objects cached), "
+                f"refine {t['refine_time']:.2f}s")
 
-        pl = kwargs.get("point_labels")
-        point_labels = [] if not pc else np.array(pl, dtype=np.float32)
 
-        all_objects = {}
+    def model_signature(self):
+        #checkpoint content + model config, part of every embedding cache key
+        if self._model_signature is None:
+            parts = [file_hash(self.path), Path(self.model_type).name]
+            #reduced precision embeddings are cached apart from fp32 ones
+            if self.precision != 'fp32':
+                parts.append(self.precision)
+            self._model_signature = text_hash(*parts)
+        return self._model_signature
 
-        for objects,bounding_box in bbox.items():
-            x1,y1,x2,y2 = bounding_box
-            box = np.array( bounding_box, dtype=np.float32)
 
-            #filter points based off bounding box
-            if point_coords is not None and len(point_coords) > 0:
-                mask_points = (point_coords[:, 0] >= x1) & (point_coords[:, 0] <= x2) & \
-                            (point_coords[:, 1] >= y1) & (point_coords[:, 1] <= y2)
+    def encode_image(self,image,image_key):
+        #runs the heavy image encoder only when the image changes, every prompt reuses the embedding
+        if self.embedded_image == image_key:
+            return
 
-                #Filtered
-                filtered_points = point_coords[mask_points]
-                filtered_labels = point_labels[mask_points]
+        cache_key = None
+        if self.embedding_cache is not None and isinstance(image_key, str):
+            cache_key = self._cache_key(image_key)
+            cached = self.embedding_cache.get(cache_key)
+            if cached is not None:
+                self._restore_features(*cached)
+                self.timings['encoder_cache_hits'] += 1
+                self.embedded_image = image_key
+                return
 
-                # If no points inside this box → set None
-                if filtered_points.shape[0] == 0:
-                    filtered_points = None
-                    filtered_labels = []
+        start = time.perf_counter()
+        with self._inference_context():
+            self.predictor.set_image(image)
+        self.timings['encoder_calls'] += 1
+        self.timings['encoder_time'] += time.perf_counter() - start
+        self.embedded_image = image_key
 
-            else:
-                filtered_points = None
-                filtered_labels = []
+        if cache_key is not None:
+            self.embedding_cache.put(cache_key, *self._export_features())
 
 
-            mask = self.segmentation_mask(image,bounding_box=box,point_coords=filtered_points,point_labels=filtered_labels)
-            refined_mask = self.mask_refining_usingCV2(mask)
+    def _cache_key(self,image_path):
+        return self.embedding_cache.make_key(file_hash(image_path), self.model_signature())
 
-            # Ensure mask is valid alpha
-            alpha = refined_mask.astype(np.uint8)
-            if alpha.max() <= 1:
-                alpha = alpha * 255
 
-            # Put refined mask into alpha channel
-            bgra = bgra_org.copy()
-            bgra[:, :, 3] = alpha
+    def _export_features(self):
+        #SAM2ImagePredictor keeps the embedding in _features/_orig_hw, there is no public accessor
+        features = self.predictor._features
+        image_embed = self._feature_array(features["image_embed"])
+        high_res_feats = [self._feature_array(feat) for feat in features["high_res_feats"]]
+        return image_embed, high_res_feats, self.predictor._orig_hw[0]
 
-            # Crop result
-            object_rgba = bgra[y1:y2, x1:x2]
 
-            all_objects[objects] = object_rgba
+    def _feature_array(self,feature):
+        return feature.float().cpu().numpy()
 
-        return all_objects
 
+    def _to_device(self,array):
+        return (array if isinstance(array, torch.Tensor) else torch.from_numpy(np.array(array))).to(self.device)
 
 
-    def segmentation_mask(self,image,bounding_box,point_coords,point_labels,
-                          multimask_output=True,
-                          mask_input=None,
-                          return_logits=False):
+    def _restore_features(self,image_embed,high_res_feats,orig_hw):
+        #puts a cached embedding back as if set_image had just run
+        self.predictor.reset_predictor()
+        self.predictor._features = {"image_embed": self._to_device(image_embed),
+                                    "high_res_feats": [self._to_device(feat) for feat in high_res_feats]}
+        self.predictor._orig_hw = [tuple(orig_hw)]
+        self.predictor._is_image_set = True
+        self.predictor._is_batch = False
 
+    
+    def segmented_objects(self,image_path, bbox: dict,image=None,**kwargs):
+        #image can be passed when the caller already has it decoded, otherwise it is read from image_path
 
-        self.predictor.set_image(image)
+        if image_path is None:
+            raise ValueError("image_path cannot be None")     
 
-        mask, score, logits = self.predictor.predict(
-        box=bounding_box,
-        point_coords=point_coords,
-        point_labels=point_labels,
-        mask_input=mask_input,
-        multimask_output=multimask_output,
-        return_logits=return_logits)
+        if not bbox:
+            return {}
 
+        #objects whose box and prompts did not change come from the mask cache, the image is
+        #only read and encoded when at least one object still has to be segmented
+        cached, missing, keys = self._split_cached(image_path,bbox,**kwargs)
+        if not missing:
+            return cached
 
-        best_mask = (None 
-                if mask is None or mask.size == 0 
-                else mask[score.argmax()] 
-                if multimask_output 
-                else mask[0] 
-                if mask.ndim == 3 
-                else mask)
-        
-        if best_mask is None:
-            segmented_mask = cv2.cvtColor(image, cv2.COLOR_BGR2BGRA)
-            return segmented_mask
-        
-        segmented_mask_uint8 = (best_mask*255).astype(np.uint8)
+        if image is None:
+            image = cv2.imread(image_path)
+        if image is None:
+            raise FileNotFoundError(f"Could not read image at path: {image_path}")
+
+        #one encoder pass for the image, then one batched decoder pass for all its boxes
+        with self.lock:
+            self.encode_image(image,image_path)
+            segmented = self._segment_encoded(image,missing,image_path=image_path,**kwargs)
+
+        self._store_cached(segmented,keys)
+        return {name: cached[name] if name in cached else segmented[name] for name in bbox}
+
+
+    def _split_cached(self,image_path,bbox,point_coords=None,point_labels=None,multimask_output=True,output='bgra',**kwargs):
+        #returns ({name: cached object}, {name: box to segment}, {name: cache key})
+        if self.mask_cache is None or not bbox:
+            return {}, dict(bbox), {}
+
+        image_hash = file_hash(image_path)
+        cached, missing, keys = {}, {}, {}
+        for name, box in bbox.items():
+            key = self.mask_cache.make_key(image_hash,self.model_signature(),box,
+                                           point_coords,point_labels,multimask_output,output)
+            found = self.mask_cache.get(key)
+            if found is None:
+                missing[name] = box
+                keys[name] = key
+            else:
+                cached[name] = found
+
+        self.timings['mask_cache_hits'] += len(cached)
+        return cached, missing, keys
+
+
+    def _store_cached(self,segmented,keys):
+        if self.mask_cache is None:
+            return
+        for name, obj in segmented.items():
+            self.mask_cache.put(keys[name], obj)
+
+
+    def prepare_image(self,image_path):
+        #encodes an image ahead of the prompts, used by the live preview
+        image = cv2.imread(image_path)
+        if image is None:
+            raise FileNotFoundError(f"Could not read image at path: {image_path}")
+        with self.lock:
+            self.encode_image(image,image_path)
+        return image
+
+
+    def preview_mask(self,image_path,box,point_coords=None,point_labels=None,multimask_output=True,size=None):
+        #decoder only mask of one box on an already encoded image, at size (w,h) (the box size when None).
+        #Only the low resolution logits are decoded, the box part of them is resized straight to size,
+        #so no full frame mask is ever built. Returns None while another thread holds the predictor
+        #or the image is not encoded yet
+        if not self.lock.acquire(blocking=False):
+            return None
+        try:
+            if self.embedded_image != image_path:
+                return None
+            x1,y1,x2,y2 = box
+            #only the points inside the box prompt it, as in decode_masks
+            coords, labels = self.points_per_box(np.array([box], dtype=np.float32),
+                                                 np.array(point_coords, dtype=np.float32) if point_coords else None,
+                                                 point_labels)
+            point_coords, point_labels = (None, None) if coords is None else (coords[0], labels[0])
+            start = time.perf_counter()
+            with self._inference_context():
+                low_res_masks, scores = self._decode_low_res(np.array(box, dtype=np.float32),point_coords,point_labels,multimask_output)
+            self.timings['decoder_calls'] += 1
+            self.timings['decoder_time'] += time.perf_counter() - start
+
+            logits = low_res_masks[0, scores[0].argmax()]
+            return self._resample_logits(logits, box, size if size is not None else (x2 - x1, y2 - y1))
+        finally:
+            self.lock.release()
+
+
+    def _resample_logits(self,logits,region,size):
+        #the region (x1,y1,x2,y2, original image pixels) of one low resolution logit map resized to
+        #size (w,h), thresholded to a uint8 mask (0/255). At the region's own size this matches the
+        #full frame upscale of SAM2ImagePredictor.predict cropped to the region
+        x1,y1,x2,y2 = region
+        height, width = self.predictor._orig_hw[0]
+        out_w, out_h = max(1, int(size[0])), max(1, int(size[1]))
+
+        #output pixel -> low res pixel (the model input is the whole frame resized to a square,
+        #half pixel centres like F.interpolate with align_corners=False)
+        low_h, low_w = logits.shape
+        ax, ay = (x2 - x1) / out_w * low_w / width, (y2 - y1) / out_h * low_h / height
+        matrix = np.array([[ax, 0, (x1 + 0.5 * (x2 - x1) / out_w) * low_w / width - 0.5],
+                           [0, ay, (y1 + 0.5 * (y2 - y1) / out_h) * low_h / height - 0.5]], dtype=np.float32)
+        roi_logits = cv2.warpAffine(logits.astype(np.float32), matrix, (out_w, out_h),
+                                    flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP, borderMode=cv2.BORDER_REPLICATE)
+        return (roi_logits > 0).astype(np.uint8) * 255
+
+
+    def _decode_low_res(self,box,point_coords,point_labels,multimask_output):
+        #the decoder part of SAM2ImagePredictor._predict without its upscale of every mask to full frame.
+        #Returns (N,C,256,256) logits and (N,C) scores as numpy arrays, N boxes share the one embedding
+        predictor = self.predictor
+        with torch.inference_mode():
+            _, coords, labels, boxes = predictor._prep_prompts(point_coords, point_labels, box, None, normalize_coords=True)
+            box_coords = boxes.reshape(-1, 2, 2)
+            box_labels = torch.tensor([[2, 3]], dtype=torch.int, device=boxes.device).repeat(box_coords.size(0), 1)
+            if coords is not None:
+                coords, labels = torch.cat([box_coords, coords], dim=1), torch.cat([box_labels, labels], dim=1)
+            else:
+                coords, labels = box_coords, box_labels
+
+            model = predictor.model
+            sparse_embeddings, dense_embeddings = model.sam_prompt_encoder(points=(coords, labels), boxes=None, masks=None)
+            low_res_masks, iou_predictions, _, _ = model.sam_mask_decoder(
+                image_embeddings=predictor._features["image_embed"][-1].unsqueeze(0),
+                image_pe=model.sam_prompt_encoder.get_dense_pe(),
+                sparse_prompt_embeddings=sparse_embeddings,
+                dense_prompt_embeddings=dense_embeddings,
+                multimask_output=multimask_output,
+                repeat_image=coords.size(0) > 1,
+                high_res_features=[feat[-1].unsqueeze(0) for feat in predictor._features["high_res_feats"]])
+
+        return low_res_masks.float().cpu().numpy(), iou_predictions.float().cpu().numpy()
+
+
+    def segment_many(self,items:dict,batch_size=4,memory_cap_mb=2048,mb_per_image=512,progress_signal=None,**kwargs):
+        #items: {image_name: {'image_path','bbox','point_coords','point_labels'}}
+        #images are encoded in batches through set_image_batch, then each image's prompts are decoded
+        #against its own embedding. Returns {object_name: object_rgba} for all images
+        with self.lock:
+            return self._segment_many(items,batch_size,memory_cap_mb,mb_per_image,progress_signal,**kwargs)
+
+
+    def _segment_many(self,items,batch_size,memory_cap_mb,mb_per_image,progress_signal,**kwargs):
+        names = list(items)
+        #keep the encoder's working memory under the cap, mb_per_image is a rough per image estimate
+        batch_size = max(1, min(int(batch_size), int(memory_cap_mb // mb_per_image)))
+        all_objects = {}
+        done = 0
+
+        for start in range(0, len(names), batch_size):
+            group = names[start:start + batch_size]
+            plans = {name: self._split_cached(items[name]['image_path'],items[name]['bbox'],
+                                              point_coords=items[name].get('point_coords'),
+                                              point_labels=items[name].get('point_labels'),
+                                              multimask_output=kwargs.get('multimask_output', True),
+                                              output=kwargs.get('output', 'bgra'))
+                     for name in group}
+
+            #only images with at least one uncached object are read and encoded
+            images = {}
+            for name in group:
+                if plans[name][1]:
+                    image_path = items[name]['image_path']
+                    image = cv2.imread(image_path)
+                    if image is None:
+                        raise FileNotFoundError(f"Could not read image at path: {image_path}")
+                    images[name] = image
+
+            batch_features = self.encode_batch([(items[name]['image_path'], images[name]) for name in images])
+
+            for name in group:
+                item = items[name]
+                cached, missing, keys = plans[name]
+                segmented = {}
+                if missing:
+                    image_path = item['image_path']
+                    if image_path in batch_features:
+                        self._restore_features(*batch_features.pop(image_path))
+                        self.embedded_image = image_path
+                    else:
+                        self.encode_image(images[name],image_path)
+
+                    segmented = self._segment_encoded(images[name],missing,
+                                                      image_path=image_path,
+                                                      point_coords=item.get('point_coords'),
+                                                      point_labels=item.get('point_labels'),
+                                                      **kwargs)
+                    self._store_cached(segmented,keys)
+
+                all_objects.update({obj: cached[obj] if obj in cached else segmented[obj] for obj in item['bbox']})
+                done += 1
+                if progress_signal is not None:
+                    progress_signal.emit(int(done / len(names) * 100))
+
+            images.clear()
+
+        return all_objects
+
+
+    def encode_batch(self,keyed_images):
+        #batch encodes the images that are not in the embedding cache
+        #returns {image_key: (image_embed, high_res_feats, orig_hw)} for what was encoded here
+        missing = []
+        for image_key, image in keyed_images:
+            if self.embedded_image == image_key:
+                continue
+            if self.embedding_cache is not None and self.embedding_cache.get(self._cache_key(image_key)) is not None:
+                continue
+            missing.append((image_key, image))
+
+        #a single image goes through the normal path in encode_image
+        if len(missing) < 2:
+            return {}
+
+        start = time.perf_counter()
+        with self._inference_context():
+            self.predictor.set_image_batch([image for _, image in missing])
+        self.timings['encoder_calls'] += 1
+        self.timings['encoder_time'] += time.perf_counter() - start
+
+        features = self.predictor._features
+        encoded = {}
+        for i, (image_key, _) in enumerate(missing):
+            image_embed = features["image_embed"][i:i + 1]
+            high_res_feats = [feat[i:i + 1] for feat in features["high_res_feats"]]
+            orig_hw = self.predictor._orig_hw[i]
+            encoded[image_key] = (image_embed, high_res_feats, orig_hw)
+
+            if self.embedding_cache is not None:
+                self.embedding_cache.put(self._cache_key(image_key),
+                                         self._feature_array(image_embed),
+                                         [self._feature_array(feat) for feat in high_res_feats],
+                                         orig_hw)
+
+        #the predictor is in batch mode now, the next encode/restore resets it
+        self.embedded_image = None
+        return encoded
+
+
+    def _segment_encoded(self,image,bbox,**kwargs):
+        #decode + refine all boxes of an image whose embedding is already in the predictor
+
+        pc = kwargs.get("point_coords")
+        point_coords = None if not pc else np.array(pc, dtype=np.float32)
 
-        return segmented_mask_uint8
+        pl = kwargs.get("point_labels")
+        point_labels = [] if not pc else np.array(pl, dtype=np.float32)
 
+        all_objects = {}
 
-    def mask_refining_usingCV2(self,mask,
-                                ksize=(7,7),sigmaX=0,sigmaY=0,
-                                kernel_shape=cv2.MORPH_ELLIPSE,kernel_size = (5,5)):
+        names = list(bbox)
+        boxes = np.array([bbox[name] for name in names], dtype=np.float32)
+        rois = [self.mask_roi(bbox[name], image.shape, kwargs.get("roi_margin", 16)) for name in names]
+        masks = self.decode_masks(boxes,point_coords,point_labels,rois,
+                                  multimask_output=kwargs.get("multimask_output", True))
 
-        mask_float = mask.astype(np.float32) / 255
-        mask_gauss_blur = cv2.GaussianBlur(mask_float, ksize, sigmaX, sigmaY)
-        mask_gauss_blur_uint8 = np.round(mask_gauss_blur*255).astype(np.uint8)
+        #output='packed' keeps a bit packed mask per object and defers refinement to to_bgra()
+        packed = kwargs.get("output", "bgra") == "packed"
 
-        kernel = cv2.getStructuringElement(kernel_shape,kernel_size)
-        mask_morph = cv2.morphologyEx(mask_gauss_blur_uint8, cv2.MORPH_CLOSE, kernel)
-        mask_morph = cv2.morphologyEx(mask_morph,cv2.MORPH_CLOSE,kernel)
+        for objects,roi,mask in zip(names,rois,masks):
+            refine_start = time.perf_counter()
+            if packed:
+                all_objects[objects] = PackedObject.from_roi_mask(kwargs.get("image_path"),mask,roi,bbox[objects],
+                                                                  point_coords=point_coords,point_labels=point_labels)
+            else:
+                #refined on the ROI only, the margin is wider than the blur + closing footprint so the
+                #box matches a full frame refine
+                all_objects[objects] = compose_object(image,mask,roi,bbox[objects])
+            self.timings['refine_time'] += time.perf_counter() - refine_start
 
-        return mask_morph
+        return all_objects
 
 
+    @staticmethod
+    def mask_roi(box,image_shape,margin=16):
+        #box plus a margin, clipped to the image
+        x1,y1,x2,y2 = box
+        height, width = image_shape[:2]
+        return (max(0, x1 - margin), max(0, y1 - margin), min(width, x2 + margin), min(height, y2 + margin))
+
+
+    @staticmethod
+    def points_per_box(boxes,point_coords,point_labels):
+        #one inside-box test for all boxes at once. Returns (N,P,2) coords and (N,P) labels padded
+        #with label -1 (SAM's "not a point"), or (None, None) when no box contains a point
+        if point_coords is None or len(point_coords) == 0:
+            return None, None
+
+        point_labels = np.asarray(point_labels, dtype=np.float32)
+        px, py = point_coords[None, :, 0], point_coords[None, :, 1]
+        inside = (px >= boxes[:, None, 0]) & (px <= boxes[:, None, 2]) & \
+                 (py >= boxes[:, None, 1]) & (py <= boxes[:, None, 3])
+
+        if not inside.any():
+            return None, None
+
+        max_points = int(inside.sum(axis=1).max())
+        coords = np.zeros((len(boxes), max_points, 2), dtype=np.float32)
+        labels = np.full((len(boxes), max_points), -1, dtype=np.float32)
+
+        #slot of every inside point within its box's row
+        slot = np.cumsum(inside, axis=1) - 1
+        box_idx, point_idx = np.nonzero(inside)
+        coords[box_idx, slot[box_idx, point_idx]] = point_coords[point_idx]
+        labels[box_idx, slot[box_idx, point_idx]] = point_labels[point_idx]
+
+        return coords, labels
+
+
+    def decode_masks(self,boxes,point_coords,point_labels,rois,multimask_output=True,max_boxes_per_call=16):
+        #batched mask decoder on the current embedding, returns one uint8 mask (0/255) per box covering
+        #its roi. Only the low resolution logits are decoded, the best one of every box is resized over
+        #its roi alone, so no full frame mask is built
+        coords, labels = self.points_per_box(boxes,point_coords,point_labels)
+        masks = []
+
+        #very crowded frames are split into a few decoder calls
+        for start in range(0, len(boxes), max_boxes_per_call):
+            stop = start + max_boxes_per_call
+            decode_start = time.perf_counter()
+            with self._inference_context():
+                low_res_masks, scores = self._decode_low_res(
+                    boxes[start:stop],
+                    None if coords is None else coords[start:stop],
+                    None if labels is None else labels[start:stop],
+                    multimask_output)
+            self.timings['decoder_calls'] += 1
+            self.timings['decoder_time'] += time.perf_counter() - decode_start
+
+            best = scores.argmax(axis=1)
+            for logits, roi in zip(low_res_masks[np.arange(len(low_res_masks)), best], rois[start:stop]):
+                rx1,ry1,rx2,ry2 = roi
+                masks.append(self._resample_logits(logits, roi, (rx2 - rx1, ry2 - ry1)))
+
+        return masks
+
+
+
+def build_segmentor(file_manager,model_type='segmentor'):
+    #loaded SamExtractor for a models_config entry. The preview entry inherits the main segmentor
+    #settings and overrides what it sets itself
+    model_path , model_config_path = file_manager.get_model_path(model_type)
+    settings = {**file_manager.get_model_settings('segmentor'), **file_manager.get_model_settings(model_type)}
+
+    embedding_cache = None
+    if settings.get('embedding_cache', True):
+        embedding_cache = shared_embedding_cache(file_manager.models_dir / "sam_embedding_cache",
+                                                 max_mb=settings.get('embedding_cache_mb', 2048),
+                                                 memory_mb=settings.get('embedding_memory_mb', 512))
+
+    #objects whose prompts did not change since the last extraction are not segmented again
+    mask_cache = None
+    if settings.get('mask_cache', True):
+        mask_cache = shared_mask_cache(settings.get('mask_cache_mb', 512))
+
+    backend = file_manager.resolve_backend(model_type)
+    precision = settings.get('precision', 'fp32')
+
+    def load():
+        if backend == 'onnx':
+            try:
+                #onnxruntime is optional, only imported when this backend is picked
+                from src.backend.onnx_sam import OnnxSamExtractor
+                sam = OnnxSamExtractor(sam_path=model_path,sam_model_config=model_config_path,
+                                       intra_op_threads=settings.get('intra_op_threads'),
+                                       inter_op_threads=settings.get('inter_op_threads'),
+                                       embedding_cache=embedding_cache,mask_cache=mask_cache,
+                                       precision=precision)
+                sam.load_device()
+                return sam
+            except Exception as e:
+                print(f"ONNX segmentor failed ({e}), falling back to the torch segmentor")
+
+        sam = SamExtractor(sam_path=model_path,sam_model_config=model_config_path,
+                           embedding_cache=embedding_cache,mask_cache=mask_cache,
+                           precision=precision)
+        sam.load_device()
+        return sam
+
+    #a loaded model with the same checkpoint and settings is reused instead of loaded again
+    key = text_hash('segmentor', model_path, model_config_path, backend, sorted(settings.items()))
+    return shared_model_pool().acquire(key, load, checkpoint_mb(model_path))
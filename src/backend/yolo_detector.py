@@ -1,19 +1,50 @@
-
 from ultralytics import YOLO
-from pathlib import Path
+import numpy as np
 import torch
 import gc
+import threading
+import cv2
+from PIL import Image
+from pathlib import Path
+
+from src.backend.detection_result import DetectionResult
+from src.backend import box_operations as box_ops
+from src.backend.image_prefetcher import ImagePrefetcher, stride_ceil
+from src.backend.model_pool import shared_model_pool
+from src.backend_helpers.hashing import file_hash
 
 
 
 class YoloDetector():
-    def __init__(self,yolo_path,gpu_id=None):
+    backend = 'torch'
+    #what load_steps yields, one label per stage
+    load_stages = ('checkpoint', 'fuse', 'warm-up')
+
+    def __init__(self,yolo_path,gpu_id=None,batch_size=8,imgsz=640,stream=True,num_threads=None,iou=0.6,conf=0.6,
+                 slice_size=None,slice_overlap=0.2,prefetch=True,prefetch_workers=4,lazy=False):
         self.path = yolo_path
         self.gpu_id = gpu_id if gpu_id is not None else 0
+        self.batch_size = max(1, int(batch_size))
+        #ultralytics rounds imgsz up to the stride for paths/arrays, prefetched tensors need it done here
+        self.imgsz = stride_ceil(imgsz)
+        self.stream = stream
+        self.num_threads = num_threads
+        self.iou = iou
+        self.conf = conf
+        self.slice_size = int(slice_size) if slice_size else None
+        self.slice_overlap = slice_overlap
+        self.prefetch = prefetch
+        self.prefetch_workers = prefetch_workers
         self.device = None
         self.model = None
+        self.fused = False
+        self.loaded = False
+        self.load_lock = threading.Lock()
+        #set while the detector is resident in the model pool
+        self.pool_key = None
         self.set_device()
-        self._load_device()
+        if not lazy:
+            self.ensure_loaded()
         
 
     def set_device(self):
@@ -31,56 +62,218 @@ class YoloDetector():
             print(f"Gpu detection failed, moving model to Cpu: {e}")
             self.device = 'cpu'
 
+        #on cpu let torch use the requested number of cores for intra-op work
+        if self.device == 'cpu' and self.num_threads:
+            torch.set_num_threads(int(self.num_threads))
+
         print(f"Using device: {self.device}")
 
 
-    def _load_device(self):
+    def ensure_loaded(self):
+        #lazy detectors (e.g. the large model of a cascade) load on first use
+        if not self.loaded:
+            for _ in self.load_steps():
+                pass
+
+
+    def load_steps(self):
+        #the load split at its stages, the label of each is yielded before it runs so a background
+        #loader can report progress and stop in between. Close the generator when stopping early,
+        #a stopped load resumes at the next stage on first use
+        with self.load_lock:
+            if self.loaded:
+                return
+            for stage in self.load_stages:
+                yield stage
+                self._load_stage(stage)
+            self.loaded = True
+
+
+    def _load_stage(self,stage):
         try:
-            print("🎬 Loading models for video extraction...")
-            self.model = YOLO(self.path).to(self.device)
-            print(f" Models loaded on {self.device}")
+            if stage == 'checkpoint' and self.model is None:
+                print("🎬 Loading models for video extraction...")
+                self.model = YOLO(self.path).to(self.device)
+            elif stage == 'fuse' and not self.fused:
+                #fuse conv+bn once here instead of on every detection call
+                self.model.fuse()
+                self.fused = True
+            elif stage == 'warm-up':
+                self._warmup()
+                print(f" Models loaded on {self.device}")
         except Exception as e:
             print(f" Error loading models: {e}")
             raise
 
+    def _warmup(self):
+        #one dummy pass so the first real batch doesn't pay for predictor setup
+        dummy = np.zeros((self.imgsz, self.imgsz, 3), dtype=np.uint8)
+        self.model.predict(dummy, imgsz=self.imgsz, device=self.device, verbose=False)
+
     def _del_device(self):
-        del self.model
+        self.model = None
+        self.fused = False
+        self.loaded = False
         gc.collect()
         torch.cuda.empty_cache()
 
     def close(self):
-        self._del_device()
+        #pooled detectors are only released, the pool decides when to unload them
+        if self.pool_key is not None:
+            shared_model_pool().release(self.pool_key)
+        else:
+            self._del_device()
+
 
+    @property
+    def names(self):
+        self.ensure_loaded()
+        return self.model.names
 
-    def object_detection(self, image_paths):  # FIX: parameter name
-        self.model.fuse()
-        All_boxes = {}
+
+    def cache_signature(self):
+        return self.make_signature(self.path, self.backend, conf=self.conf, iou=self.iou, imgsz=self.imgsz,
+                                   slice_size=self.slice_size, slice_overlap=self.slice_overlap, prefetch=self.prefetch)
+
+
+    @staticmethod
+    def make_signature(path,backend,conf=0.6,iou=0.6,imgsz=640,slice_size=None,slice_overlap=0.2,prefetch=True,**_):
+        #everything besides the image that changes the detections, computable without building a detector
+        slice_size = int(slice_size) if slice_size else None
+        return (f"{file_hash(path)}|{backend}|conf={conf}|iou={iou}|imgsz={stride_ceil(imgsz)}"
+                f"|slice={slice_size}|overlap={slice_overlap}|prefetch={bool(prefetch)}")
+
+
+    def _chunks(self, image_paths):
+        #fixed size chunks so only batch_size images are decoded/held at once
+        for start in range(0, len(image_paths), self.batch_size):
+            yield image_paths[start:start + self.batch_size]
+
+
+    def iter_object_detection(self, image_paths):
+        #yields each image's DetectionResult as soon as its chunk produces it
+        image_paths = list(image_paths)
+        self.ensure_loaded()
         
-        # FIX: Add debug print
-        print(f" Processing {len(image_paths)} images with YOLO...")
+        print(f" Processing {len(image_paths)} images with YOLO (batch size {self.batch_size})...")
         
-        results = self.model(image_paths, iou=0.6, conf = 0.6 )  # FIX: Use correct parameter name
-
-        for i, result in enumerate(results):
-            boxes = []
-
-            if result.boxes is not None:
-                for box in result.boxes:
-                    x1, y1, x2, y2 = map(int, box.xyxy[0].cpu().numpy())
-
-                    detection = {
-                        'image_index': i,
-                        'box': (x1, y1, x2, y2),
-                        'confidence': round(float(box.conf.item()), 3),
-                        'class_id': int(box.cls.item()),
-                        'class_name': self.model.names[int(box.cls.item())]
-                    }
-                    
-                    boxes.append(detection)
-                    
-
-            All_boxes[f'{Path(result.path).stem}']=boxes
+        sliced = [img_path for img_path in image_paths if self._needs_slicing(img_path)]
+        whole = [img_path for img_path in image_paths if img_path not in sliced]
+
+        if whole and self.prefetch:
+            #decode/letterbox of the next batch overlaps inference of this one
+            prefetcher = ImagePrefetcher(whole, self.imgsz, self.batch_size, workers=self.prefetch_workers,
+                                         pin_memory=self.device.startswith('cuda'))
+            for batch in prefetcher:
+                for img_path, data in zip(batch.paths, self._predict_prefetched(batch)):
+                    yield DetectionResult.from_data(img_path, data, self.names)
+
+        elif whole:
+            for chunk in self._chunks(whole):
+                for img_path, data in zip(chunk, self._predict(chunk, self.imgsz)):
+                    yield DetectionResult.from_data(img_path, data, self.names)
+
+        for img_path in sliced:
+            yield self.sliced_object_detection(img_path)
+
+
+    def _predict(self, sources, imgsz):
+        #yields one (N,6) x1,y1,x2,y2,conf,cls array per source (path or BGR array), in source order.
+        #predict defaults to batch=1, the whole chunk has to be asked for to run in one forward pass
+        results = self.model(sources, iou=self.iou, conf=self.conf, imgsz=imgsz, batch=len(sources),
+                             stream=self.stream, verbose=False)
+
+        for result in results:
+            if result.boxes is None or len(result.boxes) == 0:
+                yield np.empty((0, 6), dtype=np.float32)
+            else:
+                #one device to host copy per image
+                yield result.boxes.data.cpu().numpy()
+
+
+    def _predict_prefetched(self, batch):
+        #batch.array is already letterboxed BCHW float, ultralytics skips its own preprocessing for tensors
+        tensor = torch.from_numpy(batch.array).to(self.device, non_blocking=True)
+        results = self.model(tensor, iou=self.iou, conf=self.conf, imgsz=self.imgsz, verbose=False)
+
+        for result, (orig_hw, ratio, pad) in zip(results, batch.metas):
+            if result.boxes is None or len(result.boxes) == 0:
+                yield np.empty((0, 6), dtype=np.float32)
+                continue
+
+            data = result.boxes.data.cpu().numpy()
+            data[:, :4] = box_ops.unletterbox_boxes(data[:, :4], orig_hw, ratio, pad)
+            yield data
+
+
+    def _needs_slicing(self, image_path):
+        if not self.slice_size:
+            return False
+        #PIL only reads the header here, no full decode
+        with Image.open(image_path) as img:
+            return max(img.size) > self.slice_size
+
+
+    def sliced_object_detection(self, image_path):
+        #Tiles the full resolution frame so small sprites are detected at native scale
+        image = cv2.imread(image_path)
+        if image is None:
+            raise FileNotFoundError(f"Could not read image at path: {image_path}")
+
+        h, w = image.shape[:2]
+        tile = self.slice_size
+        tiles = [(x0, y0) for y0 in box_ops.tile_origins(h, tile, self.slice_overlap)
+                          for x0 in box_ops.tile_origins(w, tile, self.slice_overlap)]
+
+        all_xyxy, all_conf, all_cls = [], [], []
+
+        #full frame pass keeps objects bigger than a tile in one piece
+        data = next(iter(self._predict([image], self.imgsz)))
+        if len(data):
+            all_xyxy.append(data[:, :4])
+            all_conf.append(data[:, 4])
+            all_cls.append(data[:, 5])
+
+        for start in range(0, len(tiles), self.batch_size):
+            origins = tiles[start:start + self.batch_size]
+            crops = [np.ascontiguousarray(image[y0:y0 + tile, x0:x0 + tile]) for x0, y0 in origins]
+            for (x0, y0), crop, data in zip(origins, crops, self._predict(crops, tile)):
+                if len(data) == 0:
+                    continue
+
+                xyxy = data[:, :4]
+                crop_h, crop_w = crop.shape[:2]
+
+                #drop boxes cut by an inner tile edge, the neighbouring tile or the full pass has them whole
+                margin = 2
+                cut = (((xyxy[:, 0] <= margin) & (x0 > 0)) |
+                       ((xyxy[:, 1] <= margin) & (y0 > 0)) |
+                       ((xyxy[:, 2] >= crop_w - margin) & (x0 + crop_w < w)) |
+                       ((xyxy[:, 3] >= crop_h - margin) & (y0 + crop_h < h)))
+                keep = ~cut
+
+                all_xyxy.append(xyxy[keep] + np.array([x0, y0, x0, y0], dtype=np.float32))
+                all_conf.append(data[keep, 4])
+                all_cls.append(data[keep, 5])
+
+        if not all_xyxy:
+            return DetectionResult.empty(image_path, self.names)
+
+        xyxy = np.concatenate(all_xyxy)
+        conf = np.concatenate(all_conf)
+        cls = np.concatenate(all_cls)
+
+        #merge duplicates from overlapping tiles and the full pass
+        keep = box_ops.nms(xyxy, conf, self.iou, classes=cls)
+
+        print(f" Sliced {Path(image_path).stem} into {len(tiles)} tiles, {len(keep)} boxes kept")
+        return DetectionResult(image_path, xyxy[keep], conf[keep], cls[keep], self.names)
+
+
+    def object_detection(self, image_paths):
+        All_boxes = {detections.image_name: detections for detections in self.iter_object_detection(image_paths)}
         
-        print(f" Returning: {All_boxes}")
+        print(f" Returning: {list(All_boxes.values())}")
         return All_boxes
 
+
@@ -0,0 +1,37 @@
+import hashlib
+import os
+import threading
+
+
+_hash_memo = {}
+_hash_lock = threading.Lock()
+
+
+def file_hash(path, chunk_size=1024 * 1024):
+    #Content hash of a file, memoized on (path, size, mtime) so an unchanged file is only read once per session
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+    with _hash_lock:
+        if memo_key in _hash_memo:
+            return _hash_memo[memo_key]
+
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+
+    value = digest.hexdigest()
+    with _hash_lock:
+        _hash_memo[memo_key] = value
+
+    return value
+
+
+def text_hash(*parts):
+    #Short stable hash of a few strings, used to build cache keys
+    digest = hashlib.blake2b(digest_size=20)
+    for part in parts:
+        digest.update(str(part).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
@@ -1,5 +1,7 @@
 
 from PyQt6.QtCore import QThread, pyqtSignal
+import threading
+import heapq
 
 
 
@@ -46,4 +48,101 @@ class WorkerThreadYolo(QThread):
 
         result = self.func()
 
-        self.finished.emit(result)
\ No newline at end of file
+        self.finished.emit(result)
+
+class WorkerThreadYoloStream(QThread):
+    progress = pyqtSignal(int) 
+    result = pyqtSignal(object)
+    finished = pyqtSignal(object)
+
+    def __init__(self,func,total):
+        super().__init__()
+        self.func = func
+        self.total = max(1, total)
+
+    def run(self):
+        count = 0
+        for item in self.func():
+            count += 1
+            self.result.emit(item)
+            self.progress.emit(int(count / self.total * 100))
+
+        self.finished.emit(count)
+
+
+
+class WorkerThreadPriorityQueue(QThread):
+    #runs func(key) once for every key, in the given order unless prioritize() moves a key to the front.
+    #With wait_for_more the thread idles for add()/prioritize() calls until cancel()
+    progress = pyqtSignal(int)
+    result = pyqtSignal(object, object)
+    finished = pyqtSignal(object)
+
+    def __init__(self,func,keys,wait_for_more=False):
+        super().__init__()
+        self.func = func
+        self.total = max(1, len(keys))
+        self.heap = [(i, key) for i, key in enumerate(keys)]
+        self.front = 0
+        self.back = len(keys)
+        self.started_keys = set()
+        self.cancelled = False
+        self.wait_for_more = wait_for_more
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+
+    def add(self,key):
+        with self.lock:
+            if key not in self.started_keys:
+                self.total = max(self.total, len(self.started_keys) + len(self.heap) + 1)
+                heapq.heappush(self.heap, (self.back, key))
+                self.back += 1
+                self.condition.notify()
+
+    def prioritize(self,key):
+        #latest request first, keys already started are ignored
+        with self.lock:
+            if key not in self.started_keys:
+                self.front -= 1
+                heapq.heappush(self.heap, (self.front, key))
+                self.condition.notify()
+
+    def discard_pending(self):
+        #queued keys that have not started yet are dropped, the running one finishes
+        with self.lock:
+            self.heap = []
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+            self.condition.notify()
+
+    def next_key(self):
+        with self.lock:
+            while not self.cancelled:
+                while self.heap:
+                    _, key = heapq.heappop(self.heap)
+                    if key not in self.started_keys:
+                        self.started_keys.add(key)
+                        return key
+                if not self.wait_for_more:
+                    break
+                self.condition.wait()
+        return None
+
+    def run(self):
+        count = 0
+        while True:
+            key = self.next_key()
+            if key is None:
+                break
+            try:
+                value = self.func(key)
+            except Exception as e:
+                print(f"Background task failed for {key}: {e}")
+                value = None
+            count += 1
+            self.result.emit(key, value)
+            self.progress.emit(int(count / self.total * 100))
+
+        self.finished.emit(count)
@@ -2,7 +2,7 @@ from PyQt6.QtWidgets import QVBoxLayout,QWidget,QLabel,QScrollArea,QHBoxLayout,Q
 from PyQt6.QtCore import Qt,QTimer
 
 import json
-import copy
+import numpy as np
 
 
 
@@ -12,8 +12,11 @@ from src.frontend_helper import image_converters as img_conv
 from src.frontend_helper.gui_helpers import GuiHelpers
 from src.backend.image_editmanager import EditManager
 from src.backend.edit_options import EditOptions
+from src.backend.packed_object import PackedObject, as_bgra
+from src.backend.sam_detector import build_segmentor
+from src.backend.file_manager import FileManager
 from src.frontend.object_enhancement import ObjectEnhancer
-from src.backend_helpers.helper_thread import WorkerThread
+from src.backend_helpers.helper_thread import WorkerThread, WorkerThreadPriorityQueue
 from src.backend_helpers.path_helper import resource_path
 
 path = resource_path(r"src\frontend\config.json")
@@ -22,9 +25,20 @@ with open(path, "r") as f:
 
 
 class ObjectViewer(QWidget):
-    def __init__(self, extracted_objects):
+    def __init__(self, extracted_objects, final_model_type=None, lazy_segmentation=None):
         super().__init__()
-        self.extracted_object_dict  = copy.deepcopy(extracted_objects)
+        #objects are never modified in place (edits work on copies), so a shallow copy is enough.
+        #They may be dense BGRA arrays or PackedObjects that are materialized when needed
+        self.extracted_object_dict  = dict(extracted_objects)
+        #set when the objects come from the preview SAM tier, Proceed reruns them on this model
+        self.final_model_type = final_model_type
+        #lazy mode: objects start as None placeholders and are segmented in the background
+        self.lazy_segmentation = lazy_segmentation
+        self.segment_queue = None
+        if lazy_segmentation is not None:
+            self.extracted_object_dict.update({name: None for name in lazy_segmentation.object_names()})
+        self.thumbnail_holders = {}
+        self.failed_objects = []
         self.edit_manager = EditManager()
         self.gui_helper = GuiHelpers()
         self.display_size = None
@@ -62,7 +76,69 @@ class ObjectViewer(QWidget):
         self.display_size = (self.disp_w,self.disp_h)
         for image_name in self.extracted_object_dict :
             image = self.extracted_object_dict [image_name]
-            self.edit_manager.store_images_for_edits(image_name,image,self.display_size)
+            if image is not None:
+                self.edit_manager.store_images_for_edits(image_name,image,self.display_size)
+
+        if self.lazy_segmentation is not None:
+            self.start_segment_queue()
+
+
+    def start_segment_queue(self):
+        pending = [name for name,obj in self.extracted_object_dict.items() if obj is None]
+        self.segment_queue = WorkerThreadPriorityQueue(self.lazy_segmentation.segment,pending)
+        self.segmented_count = 0
+        self.segment_queue.result.connect(self.on_object_segmented)
+        self.segment_queue.finished.connect(self.on_segmentation_done)
+        self.edit_confirm_btn.setEnabled(False)
+        self.status_label.setText(f"Segmenting objects in the background (0/{len(pending)}).\nClick an object to segment it next.")
+        self.segment_queue.start()
+
+
+    def on_object_segmented(self,object_name,obj):
+        if obj is None:
+            #failed objects are dropped with their thumbnail, the rest of the session carries on
+            self.extracted_object_dict.pop(object_name,None)
+            self.failed_objects.append(object_name)
+            holder, _ = self.thumbnail_holders.pop(object_name)
+            holder.parentWidget().setVisible(False)
+            if object_name == self.current_image_name:
+                self.current_image_name = None
+                self.image_display.setText('PLEASE SELECT IMAGE FROM LEFT')
+        else:
+            self.extracted_object_dict[object_name] = obj
+            self.edit_manager.store_images_for_edits(object_name,obj,self.display_size)
+            holder, size = self.thumbnail_holders[object_name]
+            holder.setPixmap(img_conv.cv2_to_qpixmap_display(as_bgra(obj),max_size=size))
+
+        self.segmented_count += 1
+        self.status_label.setText(f"Segmenting objects in the background ({self.segmented_count}/{self.segment_queue.total}).\nClick an object to segment it next."
+                                  + self.failed_objects_text())
+        if object_name == self.current_image_name:
+            self.on_thumbnail_click(object_name)
+
+
+    def failed_objects_text(self):
+        if not self.failed_objects:
+            return ""
+        return f"\nCould not segment (removed): {', '.join(self.failed_objects)}"
+
+
+    def on_segmentation_done(self,count):
+        self.lazy_segmentation.close()
+        self.edit_confirm_btn.setEnabled(True)
+        self.status_label.setText("Please edit ALL OBJECTS before clicking 'Proceed'.\nTip: Use 'Fill Holes' to complete missing areas in objects.\nUse 'Erase' to remove unwanted points or corrections."
+                                  + self.failed_objects_text())
+
+
+    def is_ready(self,object_name):
+        return self.extracted_object_dict.get(object_name) is not None
+
+
+    def placeholder(self,object_name):
+        #dark box with the object's aspect ratio until its mask is ready
+        width, height = self.lazy_segmentation.object_size(object_name)
+        scale = 120 / max(width, height, 1)
+        return np.full((max(1, int(height * scale)), max(1, int(width * scale)), 4), (60,60,60,255), dtype=np.uint8)
 
 
     
@@ -79,8 +155,10 @@ class ObjectViewer(QWidget):
         self.thumb_widget_layout.setAlignment(Qt.AlignmentFlag.AlignTop | Qt.AlignmentFlag.AlignHCenter)
 
         for image_name in self.extracted_object_dict :
-            thumb_image = self.extracted_object_dict.get(image_name)
+            obj = self.extracted_object_dict.get(image_name)
+            thumb_image = as_bgra(obj) if obj is not None else self.placeholder(image_name)
             thumbnail = self.gui_helper.create_image_thumbnail(thumb_image,image_name,130,100,parent=self.thumb_widget)
+            self.thumbnail_holders[image_name] = (thumbnail.layout().itemAt(0).widget(),(thumbnail.width(),thumbnail.height()))
             self.thumb_widget_layout.addWidget(thumbnail)
             thumbnail.mousePressEvent = lambda event,name=image_name: self.on_thumbnail_click(name)
 
@@ -136,6 +214,9 @@ class ObjectViewer(QWidget):
             x, y = event.pos().x(), event.pos().y()
             self.drag_points.append((x, y))
 
+            if not self.is_ready(self.current_image_name):
+                return
+
             if self.fill_erase_button_dict.get("Fill Holes").isChecked():
                 self.edit_manager.apply_edits_to_display(self.current_image_name,'Pixel','fill_or_erase_point',(self.drag_points,self.cursor_size,'Fill'))
                 self.update_display_image()
@@ -152,6 +233,13 @@ class ObjectViewer(QWidget):
 
         self.current_image_name = image_name
 
+        if not self.is_ready(image_name):
+            #still in the background queue, segment it next
+            if self.segment_queue is not None:
+                self.segment_queue.prioritize(image_name)
+            self.image_display.setText('SEGMENTING OBJECT...')
+            return
+
         self.update_display_image()
 
         print(self.image_display.size())
@@ -221,6 +309,8 @@ class ObjectViewer(QWidget):
         print('undo_edits')
         self.fill_erase_button_dict['Fill Holes'].setChecked(False)
         self.fill_erase_button_dict['Erase'].setChecked(False)
+        if not self.is_ready(self.current_image_name):
+            return
         self.edit_manager.apply_edits_to_display(self.current_image_name,'Undo','Undo','Undo')
         self.update_display_image()
 
@@ -229,6 +319,8 @@ class ObjectViewer(QWidget):
         print('redo_edits')
         self.fill_erase_button_dict['Fill Holes'].setChecked(False)
         self.fill_erase_button_dict['Erase'].setChecked(False)
+        if not self.is_ready(self.current_image_name):
+            return
         self.edit_manager.apply_edits_to_display(self.current_image_name,'Redo','Redo','Redo')
         self.update_display_image()
 
@@ -250,9 +342,13 @@ class ObjectViewer(QWidget):
         print('confirm_holes_and_erase')
         final_image_dict_fill_erase = {}
 
-        for i,(image_name,org_image) in enumerate(self.extracted_object_dict.items()):
-            current_img = org_image.copy()
-            progress = int((i/len(self.extracted_object_dict))*100)
+        objects = self.extracted_object_dict
+        if self.final_model_type:
+            objects = self.segment_final_tier(progress_signal)
+
+        for i,(image_name,org_image) in enumerate(objects.items()):
+            current_img = as_bgra(org_image).copy()
+            progress = int((i/len(objects))*100)
             progress_signal.emit(progress)
             size = self.edit_manager.cached_image_size_dict[image_name]
 
@@ -278,6 +374,47 @@ class ObjectViewer(QWidget):
             
 
 
+    def segment_final_tier(self,progress_signal):
+        #the accepted preview objects are segmented again on the final model with the same boxes and
+        #prompts, so fill/erase edits made on the preview line up with the final crops
+        items = {}
+        for object_name, obj in self.extracted_object_dict.items():
+            if not isinstance(obj, PackedObject):
+                continue
+            item = items.setdefault(obj.image_path, {'image_path': obj.image_path, 'bbox': {}, 'prompts': set()})
+            item['bbox'][object_name] = obj.bbox
+            item['prompts'].update((tuple(point), label) for point, label in zip(obj.point_coords, obj.point_labels))
+
+        if not items:
+            return self.extracted_object_dict
+
+        for item in items.values():
+            prompts = sorted(item.pop('prompts'))
+            item['point_coords'] = [point for point, _ in prompts]
+            item['point_labels'] = [label for _, label in prompts]
+
+        file_manager = FileManager()
+        settings = {**file_manager.get_model_settings('segmentor'), **file_manager.get_model_settings(self.final_model_type)}
+        sam = build_segmentor(file_manager,self.final_model_type)
+        final_objects = sam.segment_many(items,
+                                         batch_size=settings.get('encoder_batch_size', 4),
+                                         memory_cap_mb=settings.get('encoder_memory_mb', 2048),
+                                         progress_signal=progress_signal,
+                                         multimask_output=settings.get('multimask_output', True))
+        print(sam.timing_report())
+        sam.close()
+
+        return {name: final_objects.get(name, obj) for name, obj in self.extracted_object_dict.items()}
+
+
+    def closeEvent(self,event):
+        #a window closed mid queue stops after the object being segmented
+        if self.segment_queue is not None and self.segment_queue.isRunning():
+            self.segment_queue.cancel()
+            self.segment_queue.wait()
+        super().closeEvent(event)
+
+
     def close_window(self,final_obj_dict):
 
         self.close()
@@ -3,15 +3,18 @@ from PyQt6.QtCore import Qt,QTimer
 import cv2
 import json
 import copy
+import threading
+import numpy as np
 
 
 from src.frontend_helper import image_converters as img_conv
 from src.frontend_helper.gui_helpers import GuiHelpers
 from src.frontend.extracted_objects import ObjectViewer
 from src.backend.image_editmanager import EditManager
-from src.backend.sam_detector import SamExtractor
+from src.backend.sam_detector import build_segmentor
+from src.backend.lazy_segmentation import LazySegmentation
 from src.backend.file_manager import FileManager
-from src.backend_helpers.helper_thread import WorkerThread
+from src.backend_helpers.helper_thread import WorkerThread,WorkerThreadPriorityQueue
 from src.backend_helpers.path_helper import resource_path
 
 path = resource_path(r"src\frontend\config.json")
@@ -21,7 +24,7 @@ with open(path, "r") as f:
 
 
 class AssertViewer(QWidget):
-    def __init__(self, boundingbox_dict):
+    def __init__(self, boundingbox_dict, segmentor_loader=None):
         super().__init__()
         self.boundingbox_dict = copy.deepcopy(boundingbox_dict)
         self.edit_manager = EditManager()
@@ -30,6 +33,20 @@ class AssertViewer(QWidget):
         self.current_image_path = None
         self.current_image_name = None
 
+        #live preview: one resident SAM, images are encoded on selection and every click only decodes
+        self.sam = None
+        #ImageViewer hands over the model it precomputed embeddings with, when it has one
+        self.segmentor_loader = segmentor_loader
+        #interactive work runs on the preview tier when models_config has one, ObjectViewer reruns the
+        #accepted objects on the final tier
+        file_manager = FileManager()
+        self.sam_model_type = file_manager.segmentor_model_type('preview')
+        self.sam_settings = {**file_manager.get_model_settings('segmentor'), **file_manager.get_model_settings(self.sam_model_type)}
+        self.sam_load_lock = threading.Lock()
+        self.preview_queue = None
+        self.preview_requests = 0
+        self.preview_image = (None, None)
+        self.preview_masks = {}
 
         self.setGeometry(100, 100, 900, 600)
         self.setFixedSize(900, 600)
@@ -112,11 +129,13 @@ class AssertViewer(QWidget):
         if self.object_select_btn_container_dict['Select Object'].isChecked():
             display_coordinates = (cordinates.x(),cordinates.y())
             self.edit_manager.apply_edits_to_display(self.current_image_name,'Pixel','get_points',(display_coordinates,'Object'))
+            self.update_preview(display_coordinates)
             self.update_display_image()
 
         elif self.object_select_btn_container_dict['Select Background'].isChecked():
             display_coordinates = (cordinates.x(),cordinates.y())
             self.edit_manager.apply_edits_to_display(self.current_image_name,'Pixel','get_points',(display_coordinates,'Background'))
+            self.update_preview(display_coordinates)
             self.update_display_image()
 
 
@@ -149,14 +168,144 @@ class AssertViewer(QWidget):
         self.current_image_name = image_name
 
         self.update_display_image()
+        self.prepare_preview(image_name)
 
 
     def update_display_image(self):
 
         display_image = self.edit_manager.get_cached_image_to_display(self.current_image_name)
+        display_image = self.overlay_preview(display_image)
         image = img_conv.cv2_to_qpixmap_display(display_image)
         self.image_display.setPixmap(image)
 
+
+    def get_segmentor(self):
+        #the model is loaded once and kept for previews and the extraction
+        with self.sam_load_lock:
+            if self.sam is None:
+                if self.segmentor_loader is not None:
+                    self.sam = self.segmentor_loader()
+                    self.segmentor_loader = None
+                else:
+                    self.sam = build_segmentor(FileManager(),self.sam_model_type)
+            return self.sam
+
+
+    def prepare_preview(self,image_name):
+        if not self.sam_settings.get('live_preview', True):
+            return
+        image_path = self.boundingbox_dict[image_name]['image_path']
+
+        #one encoder thread, latest click wins: encodes queued for earlier thumbnails are dropped
+        if self.preview_queue is None:
+            self.preview_queue = WorkerThreadPriorityQueue(self.encode_for_preview,[],wait_for_more=True)
+            self.preview_queue.result.connect(self.on_preview_encoded)
+            self.preview_queue.start()
+
+        #every click is a new key, so going back to an image encodes it again (the embedding cache makes that cheap)
+        self.preview_requests += 1
+        self.preview_queue.discard_pending()
+        self.preview_queue.prioritize((self.preview_requests, image_name, image_path))
+
+
+    def stop_preview(self):
+        #the running encode finishes, nothing new is started
+        if self.preview_queue is not None:
+            self.preview_queue.cancel()
+
+
+    def encode_for_preview(self,request):
+        _, image_name, image_path = request
+        if image_name != self.current_image_name:
+            return None
+        try:
+            image = self.get_segmentor().prepare_image(image_path)
+        except Exception as e:
+            print(f"Live preview unavailable: {e}")
+            return None
+        #a slower encode of a thumbnail clicked earlier must not replace the current image
+        if image_name == self.current_image_name:
+            self.preview_image = (image_name, image)
+        return image_name
+
+
+    def on_preview_encoded(self,request,image_name):
+        #points clicked while the encoder was running get their preview now
+        if image_name is not None and image_name == self.current_image_name:
+            self.refresh_preview()
+            self.update_display_image()
+
+
+    def update_preview(self,display_coordinates):
+        #decode only the boxes that contain the clicked point
+        name, image = self.preview_image
+        if name != self.current_image_name or image is None:
+            return
+        point = img_conv.resize_to_original_coordinates(display_coordinates,self.display_size,image)
+        bbox = self.boundingbox_dict[name]['bbox']
+        affected = [obj for obj,(x1,y1,x2,y2) in bbox.items() if x1 <= point[0] <= x2 and y1 <= point[1] <= y2]
+        self.decode_preview(affected)
+
+
+    def refresh_preview(self):
+        #after undo/redo or a late encode, every box with points or an existing preview is decoded again
+        name, image = self.preview_image
+        if name != self.current_image_name or image is None:
+            return
+        points,_ = self.edit_manager.get_image_points(name,self.display_size,image)
+        bbox = self.boundingbox_dict[name]['bbox']
+        affected = [obj for obj,(x1,y1,x2,y2) in bbox.items()
+                    if obj in self.preview_masks.get(name,{})
+                    or any(x1 <= x <= x2 and y1 <= y <= y2 for x,y in points)]
+        self.decode_preview(affected)
+
+
+    def decode_preview(self,objects):
+        name, image = self.preview_image
+        if not objects or self.sam is None:
+            return
+        image_path = self.boundingbox_dict[name]['image_path']
+        points,labels = self.edit_manager.get_image_points(name,self.display_size,image)
+        display_image = self.edit_manager.get_cached_image_to_display(name)
+        previews = self.preview_masks.setdefault(name,{})
+        for obj in objects:
+            box = self.boundingbox_dict[name]['bbox'][obj]
+            #decoded straight at the size the box has on screen
+            dx1,dy1,dx2,dy2 = self.display_box(box,display_image.shape,image.shape)
+            mask = self.sam.preview_mask(image_path,box,points,labels,
+                                         multimask_output=self.sam_settings.get('multimask_output', True),
+                                         size=(dx2 - dx1, dy2 - dy1))
+            if mask is not None:
+                previews[obj] = (box, mask)
+
+
+    @staticmethod
+    def display_box(box,display_shape,org_shape):
+        x1,y1,x2,y2 = box
+        sx, sy = display_shape[1] / org_shape[1], display_shape[0] / org_shape[0]
+        dx1, dy1 = int(x1 * sx), int(y1 * sy)
+        return dx1, dy1, max(dx1 + 1, int(x2 * sx)), max(dy1 + 1, int(y2 * sy))
+
+
+    def overlay_preview(self,display_image):
+        #tints the previewed masks on a copy of the display image, EditManager's cache stays untouched
+        name, image = self.preview_image
+        previews = self.preview_masks.get(self.current_image_name)
+        if not previews or name != self.current_image_name or image is None or display_image.ndim != 3:
+            return display_image
+
+        overlay = display_image.copy()
+        color = np.array((255,144,30,255)[:overlay.shape[2]], dtype=np.float32)
+
+        for box, mask in previews.values():
+            dx1,dy1,dx2,dy2 = self.display_box(box,overlay.shape,image.shape)
+            small = cv2.resize(mask,(dx2 - dx1, dy2 - dy1),interpolation=cv2.INTER_NEAREST) > 0
+            roi = overlay[dy1:dy2, dx1:dx2]
+            small = small[:roi.shape[0], :roi.shape[1]]
+            roi[small] = (roi[small] * 0.5 + color * 0.5).astype(overlay.dtype)
+
+        return overlay
+
     
     def add_object_points(self,container,container_layout):
         container.setVisible(False)
@@ -197,6 +346,7 @@ class AssertViewer(QWidget):
         self.object_select_btn_container_dict['Select Background'].setChecked(False)
         self.object_select_btn_container_dict['Select Object'].setChecked(False)
         self.edit_manager.apply_edits_to_display(self.current_image_name,'Undo','Undo','Undo')
+        self.refresh_preview()
         self.update_display_image()
 
 
@@ -204,16 +354,26 @@ class AssertViewer(QWidget):
         self.object_select_btn_container_dict['Select Background'].setChecked(False)
         self.object_select_btn_container_dict['Select Object'].setChecked(False)
         self.edit_manager.apply_edits_to_display(self.current_image_name,'Redo','Redo','Redo')
+        self.refresh_preview()
         self.update_display_image()
 
     
     def segment_image(self):
+        point_dict = self.edit_manager.get_points(self.display_size)
+        self.stop_preview()
+
+        if self.sam_settings.get('lazy_segmentation', True):
+            #ObjectViewer opens right away and segments the objects in the background, clicked ones first
+            lazy_segmentation = LazySegmentation(self.get_segmentor,self.segmentation_items(point_dict),
+                                                 multimask_output=self.sam_settings.get('multimask_output', True),
+                                                 output=self.segmentation_output())
+            self.close_window({},lazy_segmentation)
+            return
+
         self.control_widget.setVisible(False)
         self.progress_widget,self.progressbar = self.gui_helper.create_progressbar_container(txt="Image Segmentation in Progress",visible=True,container_size=(None,100),parent=self.main_layout_bottomwidget.parentWidget())
         self.main_layout_bottomwidget.addWidget(self.progress_widget)
 
-        point_dict = self.edit_manager.get_points(self.display_size)
-
         self.worker_thread = WorkerThread(lambda progress,point_dict=point_dict : self.segment_using_sam(progress,point_dict))
         self.worker_thread.progress.connect(self.progressbar.setValue)
         self.worker_thread.finished.connect(self.close_window)
@@ -222,35 +382,55 @@ class AssertViewer(QWidget):
 
         
 
-    def close_window(self,final_obj_dict):
+    def close_window(self,final_obj_dict,lazy_segmentation=None):
         self.close()
         self.setAttribute(Qt.WidgetAttribute.WA_DeleteOnClose, True)
-        self.object_viewer = ObjectViewer(final_obj_dict)
+        final_model_type = 'segmentor' if self.sam_model_type != 'segmentor' else None
+        self.object_viewer = ObjectViewer(final_obj_dict,final_model_type=final_model_type,lazy_segmentation=lazy_segmentation)
         self.object_viewer.show()
-        
 
 
-    def segment_using_sam(self,progress_signal,point_dict):
-        extracted_object_dict = {}
-        model_path , model_config_path = FileManager().get_model_path('segmentor')
-        self.sam = SamExtractor(sam_path=model_path,sam_model_config=model_config_path)
-        self.sam.load_device()
+    def closeEvent(self,event):
+        self.stop_preview()
+        super().closeEvent(event)
 
-        for i,image in enumerate(self.boundingbox_dict):
-            progress = int((i/len(self.boundingbox_dict))*100)
-            progress_signal.emit(progress)
 
-            image_path = self.boundingbox_dict[image]["image_path"]
-            bbox = self.boundingbox_dict[image]["bbox"]
-            point_coord = point_dict[image][0]
-            point_label = point_dict[image][1]
-            extracted_objects = self.sam.segmented_objects(image_path,bbox,point_coords=point_coord,point_labels=point_label)
-            for object_name,object in extracted_objects.items():
-                extracted_object_dict[object_name] = object
+    def segmentation_items(self,point_dict):
+        items = {}
+        for image in self.boundingbox_dict:
+            items[image] = {'image_path': self.boundingbox_dict[image]["image_path"],
+                            'bbox': self.boundingbox_dict[image]["bbox"],
+                            'point_coords': point_dict[image][0],
+                            'point_labels': point_dict[image][1]}
+        return items
 
 
+    def segmentation_output(self):
+        #preview tier objects stay packed, ObjectViewer needs their prompts for the final tier rerun.
+        #Otherwise dense BGRA unless the settings opt in to packed (smaller, but refined again on every use)
+        if self.sam_model_type != 'segmentor':
+            return 'packed'
+        return self.sam_settings.get('object_output', 'bgra')
+        
+
+
+    def segment_using_sam(self,progress_signal,point_dict):
+        settings = self.sam_settings
+        #reuses the preview model when it was loaded, only the encode already running is waited for
+        if self.preview_queue is not None:
+            self.preview_queue.wait()
+        self.get_segmentor()
+
+        #images are encoded in batches, progress is still reported per image
+        extracted_object_dict = self.sam.segment_many(self.segmentation_items(point_dict),
+                                                      batch_size=settings.get('encoder_batch_size', 4),
+                                                      memory_cap_mb=settings.get('encoder_memory_mb', 2048),
+                                                      progress_signal=progress_signal,
+                                                      multimask_output=settings.get('multimask_output', True),
+                                                      output=self.segmentation_output())
+
+        print(self.sam.timing_report())
         self.sam.close()
+        self.sam = None
 
         return extracted_object_dict
-    
-
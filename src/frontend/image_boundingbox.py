@@ -1,5 +1,5 @@
 from PyQt6.QtWidgets import QPushButton,QVBoxLayout,QWidget,QLabel,QGroupBox,QScrollArea,QHBoxLayout,QProgressBar
-from PyQt6.QtCore import Qt,QTimer
+from PyQt6.QtCore import Qt,QTimer,QThread
 import cv2
 from pathlib import Path
 import json
@@ -9,8 +9,11 @@ from itertools import chain
 
 from src.frontend_helper import image_converters as img_conv
 from src.backend.image_processing_yolo import ImageProcess
+from src.backend.file_manager import FileManager
+from src.backend import box_operations as box_ops
 from src.frontend.image_assert import AssertViewer
-from src.backend_helpers.helper_thread import WorkerThreadYolo
+from src.backend_helpers.helper_thread import WorkerThreadYoloStream, WorkerThreadPriorityQueue
+from src.backend.sam_detector import build_segmentor
 from src.backend_helpers.path_helper import resource_path
 
 path = resource_path(r"src\frontend\config.json")
@@ -28,9 +31,11 @@ def style_font(widget: QWidget, size: int = 14, bold: bool = True):
 
 
 class ImageViewer(QWidget):
-    def __init__(self, images):
+    def __init__(self, images, release_preloaded=None):
         super().__init__()
         self.images = list(images) 
+        #MainWindow holds the preloaded models until this viewer closes
+        self.release_preloaded = release_preloaded
         self.current_image_path = None
         self.yolo_selection = 0
         self.manual_selection = 0
@@ -41,7 +46,14 @@ class ImageViewer(QWidget):
         self.manualboxes = {}
         self.manualboxes_org_img = {}
         self.confirmed_objects = {}
+        self.thumbnail_holders = {}
         self.image_process = ImageProcess()
+        self.consolidation_settings = FileManager().get_model_settings('segmentor')
+        #speculative SAM embeddings, filled in the background while boxes are drawn
+        self.segmentor_model_type = FileManager().segmentor_model_type('preview')
+        self.precompute_queue = None
+        self.precompute_sam = None
+        self.segmentor_handed_over = False
 
 
         self.setGeometry(100, 100, 900, 600)
@@ -210,6 +222,7 @@ class ImageViewer(QWidget):
         image_holder.setStyleSheet(theme["LABEL_STYLE"] + " QLabel { border: 2px solid #555; border-radius: 3px; }")
 
         image_container_layout.addWidget(image_holder,alignment=Qt.AlignmentFlag.AlignCenter)
+        self.thumbnail_holders[Path(image_path).stem] = (image_holder,(image_container.width(), image_container.height()))
 
         image_label = QLabel(Path(image_path).stem)
         image_label.setWordWrap(True)
@@ -223,6 +236,7 @@ class ImageViewer(QWidget):
     def on_thumbnail_click(self,image_path):
 
         self.current_image_path = image_path
+        self.precompute_embedding(image_path,first=True)
 
         self.status_label.setText(f"Seletcted Image : {Path(self.current_image_path).stem}")
 
@@ -267,25 +281,39 @@ class ImageViewer(QWidget):
         
         self.status_label.setText("Running YOLO detection...")
         self.progress_bar.setVisible(True)
-        self.progress_bar.setValue(25)
+        self.progress_bar.setValue(0)
+        self.yolo_results = {}
 
-        def handle_yolo_result(result):
-            self.progress_bar.setValue(75)
-            
-            self.yolo_results = result
+        def handle_yolo_image(item):
+            #one image finished, show its boxes right away
+            image_name , result = item
+            self.yolo_results[image_name] = result
 
-            if self.yolo_results and len(self.yolo_results) > 0:
+            image_holder , thumb_size = self.thumbnail_holders.get(image_name,(None,None))
+            if image_holder is not None:
+                image_holder.setPixmap(img_conv.cv2_to_qpixmap_display(result[0],max_size=thumb_size))
+
+            if self.current_image_path and Path(self.current_image_path).stem == image_name:
                 self.on_thumbnail_click(self.current_image_path)
-            else:
+
+        def handle_yolo_finished(count):
+            if not any(result[1] for result in self.yolo_results.values()):
                 self.yolo_selection.setText(" AI Selection : 0 ")
                 self.status_label.setText(" No objects detected")
             
             self.progress_bar.setValue(100)
             QTimer.singleShot(1000, lambda: self.progress_bar.setVisible(False))
 
+            #images with detections are the likely ones to be segmented
+            for path in self.images:
+                if self.yolo_results.get(Path(path).stem, (None,0))[1]:
+                    self.precompute_embedding(path)
+
         try:
-            self.workerthread = WorkerThreadYolo(lambda : self.image_process.object_detection(self.images))
-            self.workerthread.finished.connect(handle_yolo_result)  
+            self.workerthread = WorkerThreadYoloStream(lambda : self.image_process.iter_object_detection(self.images),len(self.images))
+            self.workerthread.result.connect(handle_yolo_image)
+            self.workerthread.progress.connect(self.progress_bar.setValue)
+            self.workerthread.finished.connect(handle_yolo_finished)  
 
             self.workerthread.start()
             
@@ -293,9 +321,6 @@ class ImageViewer(QWidget):
         except Exception as e:
             self.status_label.setText(f"❌ YOLO Error: {str(e)}")
             print(f"YOLO Error: {e}")
-        
-
-        QTimer.singleShot(1000, lambda: self.progress_bar.setVisible(False))
 
 
     def manual_box_select(self):
@@ -436,12 +461,13 @@ class ImageViewer(QWidget):
                     manual_boundingbox = self.manualboxes_org_img.get(image_name,[])
 
                     combined = list(chain(yolo_boundingbox or [], manual_boundingbox or []))
-                    seen = set()
+
+                    # Merge overlapping YOLO/manual boxes so each object gets one SAM pass
+                    consolidated = self.consolidate_boxes(combined,yolo_box,len(yolo_boundingbox))
 
                     bounding_box = {
                         f"{image_name}_object_{i}": x
-                        for i,x in enumerate(combined)
-                        if x not in seen and not seen.add(x)
+                        for i,x in enumerate(consolidated)
                     }
 
                         
@@ -462,13 +488,81 @@ class ImageViewer(QWidget):
                 self.close_window(self.confirmed_objects)
 
 
+    def consolidate_boxes(self,combined,yolo_box,yolo_count):
+        #yolo boxes keep their confidence/class, manual boxes score 1.0 with class -1 (matches any class by IoU, never by containment)
+        detections = yolo_box[3] if yolo_box and len(yolo_box)>3 else None
+        if detections is not None and len(detections) == yolo_count:
+            scores = list(detections.conf) + [1.0]*(len(combined)-yolo_count)
+            classes = list(detections.cls) + [-1]*(len(combined)-yolo_count)
+        else:
+            scores = [1.0]*len(combined)
+            classes = [-1]*len(combined)
+
+        settings = self.consolidation_settings
+        return box_ops.consolidate_boxes(combined,scores,classes,
+                                         iou_threshold=settings.get('box_iou_threshold', 0.7),
+                                         containment_threshold=settings.get('box_containment_threshold', 0.95),
+                                         class_aware=settings.get('box_class_aware', True),
+                                         merge=settings.get('box_merge', False))
+
+
+    def precompute_embedding(self,image_path,first=False):
+        #one lowest priority thread encodes queued images into the shared embedding cache, the
+        #image currently opened goes first. Confirming only leaves the mask decoder to run
+        if not self.consolidation_settings.get('speculative_embeddings', True):
+            return
+
+        if self.precompute_queue is None:
+            self.precompute_queue = WorkerThreadPriorityQueue(self.encode_speculatively,[],wait_for_more=True)
+            self.precompute_queue.start(QThread.Priority.LowestPriority)
+
+        if first:
+            self.precompute_queue.prioritize(image_path)
+        else:
+            self.precompute_queue.add(image_path)
+
+
+    def encode_speculatively(self,image_path):
+        if self.precompute_sam is None:
+            self.precompute_sam = build_segmentor(FileManager(),self.segmentor_model_type)
+        self.precompute_sam.prepare_image(image_path)
+
+
+    def hand_over_segmentor(self):
+        #called from AssertViewer's worker: the speculative model is reused once its current image is done
+        if self.precompute_queue is not None:
+            self.precompute_queue.wait()
+        if self.precompute_sam is not None:
+            return self.precompute_sam
+        return build_segmentor(FileManager(),self.segmentor_model_type)
+
+
     def close_window(self,confirmed_objects):
         self.image_process.close()
-        self.assert_viewer = AssertViewer(confirmed_objects)
+        if self.precompute_queue is not None:
+            self.precompute_queue.cancel()
+        self.segmentor_handed_over = True
+        self.assert_viewer = AssertViewer(confirmed_objects,segmentor_loader=self.hand_over_segmentor)
         self.assert_viewer.show()
         self.close()
         self.setAttribute(Qt.WidgetAttribute.WA_DeleteOnClose, True)
 
+
+    def closeEvent(self,event):
+        #closed without confirming: the idle precompute thread is stopped and the speculative model
+        #released, after a hand over AssertViewer waits for the thread and owns the model
+        if not self.segmentor_handed_over:
+            if self.precompute_queue is not None:
+                self.precompute_queue.cancel()
+                self.precompute_queue.wait()
+            if self.precompute_sam is not None:
+                self.precompute_sam.close()
+                self.precompute_sam = None
+        if self.release_preloaded is not None:
+            self.release_preloaded()
+            self.release_preloaded = None
+        super().closeEvent(event)
+
     
             
 
@@ -1,10 +1,15 @@
-from PyQt6.QtWidgets import QPushButton,QVBoxLayout,QWidget,QHBoxLayout,QMainWindow,QLabel,QGroupBox,QSizePolicy
-from PyQt6.QtCore import Qt
+from PyQt6.QtWidgets import QApplication,QPushButton,QVBoxLayout,QWidget,QHBoxLayout,QMainWindow,QLabel,QGroupBox,QSizePolicy
+from PyQt6.QtCore import Qt,QThread
 from PyQt6.QtGui import QFont,QPixmap
+import threading
 import json
 
 
 from src.frontend.image_boundingbox import ImageViewer
+from src.backend.file_manager import FileManager
+from src.backend.image_processing_yolo import ImageProcess
+from src.backend.sam_detector import build_segmentor
+from src.backend_helpers.helper_thread import WorkerThread
 from src.backend_helpers.path_helper import resource_path
 
 path = resource_path(r"src\frontend\config.json")
@@ -18,6 +23,13 @@ class MainWindow(QMainWindow):
         self.images=[]
         self.videos = []
         self.max_limit_reached = False
+        #models loaded in the background while files are dropped, held until the viewer takes over
+        self.preload_thread = None
+        self.preloaded_models = []
+        self.preload_cancelled = False
+        self.preload_released = False
+        self.preload_running = False
+        self.preload_lock = threading.Lock()
         self.set_ui()
 
         
@@ -104,11 +116,125 @@ class MainWindow(QMainWindow):
 
         layout.addWidget(self.drop_group)
 
+        self.preload_label = QLabel("")
+        self.preload_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.preload_label.setStyleSheet("color: #888; font-size: 12px;")
+        layout.addWidget(self.preload_label)
+
+
+    def start_preloading(self):
+        #detector (and the segmentor when its settings ask for it) go into the model pool in the
+        #background, ImageViewer then gets them without waiting for the checkpoint load
+        file_manager = FileManager()
+        model_types = []
+        detector_settings = file_manager.get_model_settings('detector')
+        #with detection worker processes every process loads its own model, nothing to warm up here
+        if detector_settings.get('preload', True) and detector_settings.get('workers', 1) <= 1:
+            model_types.append('detector')
+        if file_manager.get_model_settings('segmentor').get('preload', False):
+            model_types.append(file_manager.segmentor_model_type('preview'))
+        if not model_types:
+            return
+
+        self.preload_label.setText("Loading models in the background...")
+        self.preload_running = True
+        self.preload_thread = WorkerThread(lambda progress,model_types=model_types: self.preload_models(progress,model_types))
+        self.preload_thread.progress.connect(lambda value: self.preload_label.setText(f"Loading models in the background... {value}%"))
+        self.preload_thread.finished.connect(self.on_preload_finished)
+        #the load outlives this window once the viewer took over, it is only stopped when the app quits
+        QApplication.instance().aboutToQuit.connect(lambda: self.stop_preloading(wait=True))
+        self.preload_thread.start(QThread.Priority.LowPriority)
+
+
+    def preload_models(self,progress_signal,model_types):
+        #the detector loads stage by stage (checkpoint, fuse, warm-up), the cancel flag is checked
+        #between stages and models. A stage that already started runs to its end
+        file_manager = FileManager()
+        try:
+            for index, model_type in enumerate(model_types):
+                if self.preload_cancelled:
+                    break
+                if model_type == 'detector':
+                    #lazy: only the pool entry, the weights load in the steps below
+                    model = ImageProcess.build_detector(file_manager, lazy=True)
+                    if not self.hold_preloaded(model):
+                        break
+                    steps = model.load_steps()
+                    stages = len(model.load_stages)
+                    try:
+                        for done, _ in enumerate(steps):
+                            if self.preload_cancelled:
+                                break
+                            progress_signal.emit(int((index + done / stages) / len(model_types) * 100))
+                    finally:
+                        #releases the detector's load lock when stopped between stages
+                        steps.close()
+                else:
+                    if not self.hold_preloaded(build_segmentor(file_manager, model_type)):
+                        break
+                progress_signal.emit(int((index + 1) / len(model_types) * 100))
+        except Exception as e:
+            print(f"Model preloading failed, models load when needed: {e}")
+        finally:
+            self.end_preload()
+        return not self.preload_cancelled
+
+
+    def end_preload(self):
+        #references released while the load was running are let go once it is done
+        with self.preload_lock:
+            self.preload_running = False
+            released = self.preload_released
+        if released:
+            self.release_preloaded()
+
+
+    def hold_preloaded(self,model):
+        #held until the viewer is done with them, a model arriving after the cancel is released right away
+        with self.preload_lock:
+            if not self.preload_cancelled:
+                self.preloaded_models.append(model)
+                return True
+        #nobody holds it anymore, it stays warm in the pool until evicted
+        model.close()
+        return False
+
+
+    def on_preload_finished(self,completed):
+        if completed:
+            self.preload_label.setText("Models ready" if self.preloaded_models else "")
+
+
+    def release_preloaded(self):
+        #the held references go, a load still running keeps them until it is done (end_preload)
+        with self.preload_lock:
+            self.preload_released = True
+            if self.preload_running:
+                return
+            models, self.preloaded_models = self.preloaded_models, []
+
+        #released models stay resident in the pool until the budget needs room
+        for model in models:
+            model.close()
+
+
+    def stop_preloading(self,wait=False):
+        #the preload thread stops at its next stage boundary, what it loaded so far is released
+        with self.preload_lock:
+            self.preload_cancelled = True
+
+        if self.preload_thread is not None and wait:
+            self.preload_thread.wait()
+
+        self.release_preloaded()
+
     
     def navigate_to_appropriate_viewer(self):
         
         if self.images and not self.videos:
-            self.image_viewer = ImageViewer(self.images)
+            #a running preload keeps going (the pool hands the viewer the same model once it is loaded),
+            #the viewer releases the held references when it closes
+            self.image_viewer = ImageViewer(self.images,release_preloaded=self.release_preloaded)
             self.image_viewer.show()
             self.close()
             self.setAttribute(Qt.WidgetAttribute.WA_DeleteOnClose, True)
@@ -247,6 +373,14 @@ class MainWindow(QMainWindow):
         self.update_labels()
 
 
+    def closeEvent(self, event):
+        #closing before the viewer opened closes the app: a running load is stopped and waited for.
+        #After the hand over the load keeps running for the viewer
+        if not hasattr(self, 'image_viewer'):
+            self.stop_preloading(wait=True)
+        super().closeEvent(event)
+
+
     #Drag/drop event
     def dragEnterEvent(self, event):
         if event.mimeData().hasUrls():